@@ -0,0 +1,112 @@
+"""alignment.py
+
+Separate module for aligning tokens with the raw text they were taken from.
+
+The alignment has two arrays with for each token the character offset in the
+raw text where it starts and where it ends. Both arrays are in increasing order,
+so going from a character offset to a token is a binary search and going from a
+token to its characters is just an array lookup. Like the positional index, the
+alignment is only arrays and it can be saved with write_arrays().
+
+The tokenizer does not always return substrings of the text. Double quotes are
+turned into `` and '' and those two are sometimes turned into each other, so a
+quote token can match any of the three. A token that is not found near where the
+previous token ended gets an empty span at that point, so that one odd token does
+not throw off all tokens after it.
+
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+# How many characters past the end of the previous token we look for a token,
+# this keeps the alignment linear in the length of the text
+WINDOW = 256
+
+# Tokens that the tokenizer creates from other strings in the raw text
+REWRITES = {
+    '``': ('"', '``', "''"),
+    "''": ('"', "''", '``')}
+
+
+class Alignment(object):
+
+    """Character spans of the tokens of a text."""
+
+    def __init__(self, starts, ends):
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def from_tokens(cls, tokens, raw, window=WINDOW):
+        """Align a sequence of tokens with the raw text."""
+        starts = array('I')
+        ends = array('I')
+        cursor = 0
+        for token in tokens:
+            start, end = find_token(raw, token, cursor, window)
+            if start < 0:
+                start = end = cursor
+            starts.append(start)
+            ends.append(end)
+            cursor = end
+        return cls(starts, ends)
+
+    @classmethod
+    def from_arrays(cls, meta, arrays):
+        """Create the alignment from the meta data and arrays returned by
+        read_arrays() for a file written with the output of to_arrays()."""
+        return cls(arrays['starts'], arrays['ends'])
+
+    def to_arrays(self):
+        """Return meta data and arrays for write_arrays()."""
+        return {}, {'starts': self.starts, 'ends': self.ends}
+
+    def __str__(self):
+        return "<Alignment tokens=%d>" % len(self)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def span(self, i):
+        """Return the start and end character offsets of token i."""
+        return self.starts[i], self.ends[i]
+
+    def char_span(self, first, last):
+        """Return the character offsets covering the tokens from first up to but
+        not including last, the span is empty if there are no such tokens."""
+        if first >= last:
+            if first < len(self):
+                offset = self.starts[first]
+            else:
+                offset = self.ends[-1] if len(self) else 0
+            return offset, offset
+        return self.starts[first], self.ends[last - 1]
+
+    def token_at(self, offset):
+        """Return the token that the character at the offset is part of, or None if
+        the character is not part of any token (for example, white space)."""
+        i = bisect_right(self.starts, offset) - 1
+        if i >= 0 and offset < self.ends[i]:
+            return i
+        return None
+
+    def token_span(self, start, end):
+        """Return the first and last token (the latter not included) that overlap
+        with the characters from start up to end."""
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end, first)
+        return first, max(first, last)
+
+
+def find_token(raw, token, cursor, window=WINDOW):
+    """Return the start and end of the first occurrence of the token or one of its
+    rewrites in the raw text, only looking at the window after the cursor. Returns
+    (-1, -1) if the token is not found."""
+    best = (-1, -1)
+    for string in REWRITES.get(token, (token,)):
+        start = raw.find(string, cursor, cursor + window + len(string))
+        if start >= 0 and (best[0] < 0 or start < best[0]):
+            best = (start, start + len(string))
+    return best
@@ -0,0 +1,222 @@
+"""cache.py
+
+Separate module to store code for caching tokenized texts on disk.
+
+The cache for a text is a file in CACHE_DIR whose name is a hash of the paths,
+modification times and sizes of the source files (or, optionally, of their
+content) and of the tokenizer version. It has the token types, an array with a
+type id for each token and an array with the end offset of each sentence.
+Loading the cache memory-maps the file so the arrays are not read or copied.
+
+The file format is generic so it is also used for other artifacts: a magic
+string, the length of a JSON header, the JSON header itself and then the raw
+bytes of a series of arrays, each starting at a multiple of eight bytes. The
+header has a dictionary with meta data (which can include lists of strings) and
+the type code, offset and length of each array.
+
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+from array import array
+
+import nltk
+
+from reader import source_files, read_chunks
+
+
+# Directory where cached tokenizations are written
+CACHE_DIR = 'cache'
+
+# Bump this whenever the format of the files or the way we tokenize changes,
+# this invalidates all cached files.
+CACHE_VERSION = 2
+
+# The tokenizer, as part of the cache key
+TOKENIZER = 'nltk.word_tokenize/%s' % nltk.__version__
+
+MAGIC = b'TXTARRAY'
+
+
+### Generic array files
+
+def write_arrays(filename, meta, arrays):
+    """Write the meta data and a dictionary of arrays indexed on names to a file.
+    The file is written under a temporary name first so that readers never see
+    a half-written file."""
+    sections = {}
+    offset = 0
+    for name, data in arrays.items():
+        sections[name] = (data.typecode, offset, len(data))
+        offset += padded(len(data) * data.itemsize)
+    header = json.dumps({'meta': meta, 'byteorder': sys.byteorder, 'sections': sections})
+    header = header.encode('utf-8')
+    header += b' ' * (padded(len(MAGIC) + 4 + len(header)) - len(MAGIC) - 4 - len(header))
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp_filename, 'wb') as fh:
+        fh.write(MAGIC)
+        fh.write(struct.pack('<I', len(header)))
+        fh.write(header)
+        for data in arrays.values():
+            size = len(data) * data.itemsize
+            data.tofile(fh)
+            fh.write(b'\0' * (padded(size) - size))
+    os.replace(tmp_filename, filename)
+
+
+def read_arrays(filename):
+    """Return the meta data and a dictionary of arrays from a file written by
+    write_arrays(). The arrays are read-only memoryviews on a memory map of the
+    file. Returns None if the file does not exist or was written on a machine
+    with a different byte order."""
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as fh:
+        if os.path.getsize(filename) < len(MAGIC) + 4:
+            return None
+        buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        return None
+    header_length = struct.unpack('<I', buffer[len(MAGIC):len(MAGIC) + 4])[0]
+    start = len(MAGIC) + 4
+    header = json.loads(buffer[start:start + header_length].decode('utf-8'))
+    if header['byteorder'] != sys.byteorder:
+        return None
+    start += header_length
+    view = memoryview(buffer)
+    arrays = {}
+    for name, (typecode, offset, length) in header['sections'].items():
+        size = length * array(typecode).itemsize
+        arrays[name] = view[start + offset:start + offset + size].cast(typecode)
+    return header['meta'], arrays
+
+
+def padded(size):
+    """Round up to a multiple of eight."""
+    return (size + 7) // 8 * 8
+
+
+### Tokenization cache
+
+def cache_key(path, content_hash=False, version=TOKENIZER):
+    """Return a hash that identifies the source files and the tokenizer. By default
+    this uses the path, modification time and size of each file, which is cheap
+    but means that touching a file invalidates its cache. With content_hash=True
+    the content of the files is used instead of their modification times."""
+    key = hashlib.sha1()
+    key.update(("%s %s\n" % (CACHE_VERSION, version)).encode('utf-8'))
+    for filename in source_files(path):
+        key.update(os.path.abspath(filename).encode('utf-8'))
+        if content_hash:
+            with open(filename, 'rb') as fh:
+                for block in iter(lambda: fh.read(2 ** 20), b''):
+                    key.update(block)
+        else:
+            stat = os.stat(filename)
+            key.update((" %d %d\n" % (stat.st_mtime_ns, stat.st_size)).encode('utf-8'))
+    return key.hexdigest()
+
+
+def cache_file(path, suffix, cache_dir=CACHE_DIR, content_hash=False, version=TOKENIZER):
+    return os.path.join(cache_dir, "%s.%s" % (cache_key(path, content_hash, version), suffix))
+
+
+def load_tokens(path, cache_dir=CACHE_DIR, content_hash=False):
+    """Return the cached TokenArrays for the path or None if there is none."""
+    if not source_files(path):
+        return None
+    result = read_arrays(cache_file(path, 'tokens', cache_dir, content_hash))
+    if result is None:
+        return None
+    meta, arrays = result
+    return TokenArrays(meta['types'], arrays['ids'], arrays['sentence_ends'])
+
+
+def store_tokens(path, tokens, cache_dir=CACHE_DIR, content_hash=False):
+    meta = {'path': path, 'tokenizer': TOKENIZER, 'types': tokens.types}
+    arrays = {'ids': tokens.ids, 'sentence_ends': tokens.sentence_ends}
+    write_arrays(cache_file(path, 'tokens', cache_dir, content_hash), meta, arrays)
+
+
+def tokenize(path, cache_dir=CACHE_DIR, content_hash=False):
+    """Return the tokens of the file or directory as a TokenArrays instance, from
+    the cache if possible and otherwise by tokenizing and caching the result.
+    Returns None if there is no such file or directory."""
+    if not source_files(path):
+        return None
+    tokens = load_tokens(path, cache_dir, content_hash)
+    if tokens is None:
+        tokens = TokenArrays.from_sentences(stream_sentences(path))
+        store_tokens(path, tokens, cache_dir, content_hash)
+    return tokens
+
+
+def load_artifact(path, suffix, cache_dir=CACHE_DIR, content_hash=False, version=TOKENIZER):
+    """Return the meta data and arrays of something derived from the tokens of the
+    file or directory, like a positional index, or None if it is not cached. The
+    version should identify everything that the artifact depends on."""
+    return read_arrays(cache_file(path, suffix, cache_dir, content_hash, version))
+
+
+def store_artifact(path, suffix, meta, arrays, cache_dir=CACHE_DIR, content_hash=False,
+                   version=TOKENIZER):
+    write_arrays(cache_file(path, suffix, cache_dir, content_hash, version), meta, arrays)
+
+
+def stream_sentences(path):
+    """Generate the sentences in the file or directory as lists of tokens. This
+    does what nltk.word_tokenize() does, but keeps the sentences."""
+    for chunk in read_chunks(path):
+        for sentence in nltk.sent_tokenize(chunk):
+            yield nltk.word_tokenize(sentence, preserve_line=True)
+
+
+class TokenArrays(object):
+
+    """A sequence of tokens stored as a list of types, an array of type ids, one
+    for each token, and an array with for each sentence the offset of the token
+    after the sentence. Indexing and iteration give the tokens themselves."""
+
+    def __init__(self, types, ids, sentence_ends):
+        self.types = types
+        self.ids = ids
+        self.sentence_ends = sentence_ends
+
+    @classmethod
+    def from_sentences(cls, sentences):
+        type_ids = {}
+        ids = array('I')
+        sentence_ends = array('I')
+        for sentence in sentences:
+            ids.extend(type_ids.setdefault(t, len(type_ids)) for t in sentence)
+            sentence_ends.append(len(ids))
+        return cls(list(type_ids), ids, sentence_ends)
+
+    def __str__(self):
+        return "<TokenArrays tokens=%d types=%d sentences=%d>" \
+            % (len(self.ids), len(self.types), len(self.sentence_ends))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.types[t] for t in self.ids[i]]
+        return self.types[self.ids[i]]
+
+    def __iter__(self):
+        return map(self.types.__getitem__, self.ids)
+
+    def sentences(self):
+        """Generate the sentences as lists of tokens."""
+        start = 0
+        for end in self.sentence_ends:
+            yield self[start:end]
+            start = end
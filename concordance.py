@@ -0,0 +1,106 @@
+"""concordance.py
+
+Separate module for a positional index on a text and for keyword in context
+(KWIC) lookups on that index.
+
+The index maps each lower cased type to the positions where it occurs in the
+text. It is stored as two arrays: one with all positions, ordered on type and
+then on position, and one with for each type where its positions start in the
+first array. Looking up a word is a dictionary lookup and an array slice, and
+since the index is just arrays it can be saved with write_arrays() and loaded
+with a memory map.
+
+"""
+
+from array import array
+from itertools import accumulate
+from collections import Counter
+
+from nltk.text import ConcordanceLine
+
+
+class PositionalIndex(object):
+
+    """Positional index on a sequence of tokens, with a KWIC method that returns
+    structured results (instances of nltk.text.ConcordanceLine, which is what
+    nltk.text.Text.concordance() prints)."""
+
+    def __init__(self, tokens, types, starts, positions):
+        """Initialize from the tokens, a list of lower cased types and the arrays
+        described in the module documentation. Use the class methods to create
+        an index from tokens or to load one."""
+        self.tokens = tokens
+        self.types = types
+        self.type_ids = {t: i for i, t in enumerate(types)}
+        self.starts = starts
+        self.positions = positions
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        """Create the index for a list of tokens or for a TokenArrays instance."""
+        if hasattr(tokens, 'ids'):
+            # lower case the types, not all tokens
+            type_ids = {}
+            lower_ids = [type_ids.setdefault(t.lower(), len(type_ids)) for t in tokens.types]
+            ids = list(map(lower_ids.__getitem__, tokens.ids))
+        else:
+            type_ids = {}
+            ids = [type_ids.setdefault(t.lower(), len(type_ids)) for t in tokens]
+        # a stable sort keeps the positions of each type in order
+        positions = array('I', sorted(range(len(ids)), key=ids.__getitem__))
+        counts = Counter(ids)
+        starts = array('I', accumulate(map(counts.__getitem__, range(len(type_ids))),
+                                       initial=0))
+        return cls(tokens, list(type_ids), starts, positions)
+
+    @classmethod
+    def from_arrays(cls, tokens, meta, arrays):
+        """Create the index from the meta data and arrays returned by read_arrays()
+        for a file written with the meta data and arrays from to_arrays()."""
+        return cls(tokens, meta['types'], arrays['starts'], arrays['positions'])
+
+    def to_arrays(self):
+        """Return meta data and arrays for write_arrays()."""
+        return {'types': self.types}, {'starts': self.starts, 'positions': self.positions}
+
+    def __str__(self):
+        return "<PositionalIndex types=%d tokens=%d>" % (len(self.types), len(self.positions))
+
+    def offsets(self, word):
+        """Return the positions of the word, ignoring case."""
+        i = self.type_ids.get(word.lower())
+        if i is None:
+            return self.positions[0:0]
+        return self.positions[self.starts[i]:self.starts[i + 1]]
+
+    def count(self, word):
+        return len(self.offsets(word))
+
+    def kwic(self, word, width=79, offset=0, limit=25):
+        """Return a list of concordance lines for the word, starting at the match
+        with the given offset and with at most limit lines (all lines if limit is
+        None). The width is the width in characters of the printed lines."""
+        half_width = (width - len(word) - 2) // 2
+        context = width // 4
+        positions = self.offsets(word)
+        end = len(positions) if limit is None else offset + limit
+        lines = []
+        for i in positions[offset:end]:
+            query = self.tokens[i]
+            left = self.tokens[max(0, i - context):i]
+            right = self.tokens[i + 1:i + context]
+            left_print = ' '.join(left)[-half_width:].rjust(half_width)
+            right_print = ' '.join(right)[:half_width]
+            line = ' '.join([left_print, query, right_print])
+            lines.append(ConcordanceLine(left, query, right, i, left_print, right_print, line))
+        return lines
+
+    def print_kwic(self, word, width=79, lines=25):
+        """Print the concordance lines like nltk.text.Text.concordance() does."""
+        matches = self.count(word)
+        if not matches:
+            print("No matches")
+            return
+        print("Displaying %d of %d matches:" % (min(lines, matches), matches))
+        for line in self.kwic(word, width, limit=lines):
+            print(line.line)
@@ -1,10 +1,49 @@
-"""fsa.py
+r"""fsa.py
 
 Separate module to store most FSA related code.
 
+An FSA can be compiled into a CompiledFSA, which has the same transitions in a
+flat array of integers. Symbols are interned as integers and the input for a
+CompiledFSA is a sequence of symbol ids, matching on that does not create any
+objects and does not change the automaton, so it can be done from several
+threads at once.
+
+An FSA can also be created from a regular expression over tokens, like
+
+   Sir (Robin|Galahad)+ the? Brave
+
+where symbols are tokens separated by white space and where parentheses, |, *,
++ and ? are used as usual (use a backslash to make any of them part of a token).
+The expression is turned into a non-deterministic automaton, which is then made
+deterministic with the subset construction and minimized with Hopcroft's
+algorithm.
+
+Transitions can also be on classes of tokens (see TokenClass), in the regular
+expressions these are written between angle brackets:
+
+   <any>           any token
+   <re:[A-Z]\w*>   tokens that match a regular expression
+   <lower:sir>     tokens that are 'sir' when lower cased
+   <tag:NNP>       tagged tokens, that is (word, tag) pairs, with the tag NNP
+   <name>          tokens for which the predicate with that name is true
+
+A state first looks up a token in its dictionary of exact transitions and only
+tries its token classes if that fails. The regular expression compiler makes
+sure that an exact transition also goes where the classes that the token is in
+go. The classes of a state may overlap, a token that is in more than one of
+them goes to all of their targets at once, that is, to the UnionState for that
+set of states. Union states are only created when a token first needs them, so
+overlapping classes are never split into all their combinations.
 
 """
 
+import re
+import threading
+from array import array
+
+# Characters with a special meaning in token regular expressions
+OPERATORS = '()|*+?<'
+
 class FSA(object):
     
     """Class to implement a simple deterministic FSA."""
@@ -13,13 +52,14 @@ class FSA(object):
         """Initialize with a set of states, final states and transitions."""
         self.name = name
         self.states = {}
+        self.unions = {}
         for state_name in states:
-            state = State(state_name)
+            state = State(state_name, self.unions)
             if state_name in final_states:
                 state.is_final = True
             self.states[state_name] = state
         for s1, label, s2 in transitions:
-            self.states[s1].transitions[label] = self.states[s2]
+            self.states[s1].add_transition(label, self.states[s2])
             
     def __str__(self):
         return "<FSA with %d states>" % len(self.states)
@@ -29,73 +69,883 @@ class FSA(object):
         for state_symbol in sorted(self.states):
             state = self.states[state_symbol]
             print('  ', state)
-            for symbol, target in state.transitions.items():
+            for symbol, target in state.items():
                 # U+27f6 = 'LONG RIGHTWARDS ARROW'
                 print('      %s \u27f6 %s' % (symbol, target.name))
 
-    def print_state(self, indent=0, debug=True):
-        if debug:
-            print("%s%s %s . %s" % (' ' * indent, self.current_state, 
-                                    ' '.join(self.consumed), ' '.join(self.queue[:5])))
-
-    def consume(self, sequence, debug=False):
-        """Given a sequence, consume as many vocabulary elements from the beginning as
-        possible. Returns a Match instance if input was consumed or False if no match
-        was found."""
-        self.input_tape = sequence
-        self.queue = list(sequence)
-        self.consumed = []
-        self.current_state = self.states['S0']
-        # storing the longest match if there is a match
-        self.match = False
-        self.print_state(indent=3, debug=debug)
-        while self.queue:
-            next_symbol = self.queue.pop(0)
-            if next_symbol in self.current_state.transitions:
-                self.current_state = self.current_state.transitions[next_symbol]
-                self.consumed.append(next_symbol)
-                if self.current_state.is_final:
-                    self.match = Match(self)
-            else:
+    def consume(self, sequence, debug=False, start=0):
+        """Given a sequence, consume as many vocabulary elements from the beginning (or
+        from the start offset) as possible. Returns a Match instance if input was
+        consumed or False if no match was found. All state of the run is kept in a
+        Cursor and not on the FSA, so one FSA can be used by several threads."""
+        cursor = Cursor(self, sequence, start)
+        cursor.run(debug=debug)
+        return cursor.match
+
+    def longest_match(self, sequence, start=0):
+        """Return the end offset of the longest match that starts at the start offset
+        in the sequence, or None if there is no match. Unlike consume() this does not
+        create a Cursor or a Match."""
+        state = self.states['S0']
+        end = None
+        for i in range(start, len(sequence)):
+            state = state.next(sequence[i])
+            if state is None:
                 break
-            self.print_state(indent=3, debug=debug)
-        return self.match
-        
+            if state.is_final:
+                end = i + 1
+        return end
+
+    @classmethod
+    def from_regex(cls, name, pattern, predicates=None):
+        """Create the smallest deterministic FSA for a token regular expression. The
+        predicates dictionary has the functions for predicate classes."""
+        nfa = NFA.from_tree(parse_regex(pattern, predicates))
+        size, finals, transitions = determinize(nfa)
+        while True:
+            states, final_states, labeled = minimize(size, finals, transitions)
+            # leaving out transitions can make more states equal, so repeat
+            # until nothing changes
+            if len(states) == size:
+                return cls(name, states, final_states, labeled)
+            size = len(states)
+            finals = set(int(state[1:]) for state in final_states)
+            transitions = {}
+            for s1, label, s2 in labeled:
+                transitions.setdefault(int(s1[1:]), {})[label] = int(s2[1:])
+
+    def compile(self):
+        """Return a CompiledFSA for this FSA."""
+        return CompiledFSA(self)
+
     def accept(self, sequence):
         """Returns True if a full match for the sequence was found, False otherwise."""
         match = self.consume(sequence)
         # simply check whether the match was for the full sequence
-        return match and len(match.consumed) == len(sequence)
+        return match and len(match) == len(sequence)
+
+
+class CompiledFSA(object):
+
+    """An FSA with interned symbols and a dense transition table. State 0 is the
+    start state, the table has a column for each symbol id with for each state
+    the target state or -1, and the final states are a bitmap. Each exact symbol
+    of the FSA gets an id. If the FSA has token classes, then other tokens get an
+    id for the combination of classes they are in, the column for such an id is
+    added to the table when a token with that combination is first interned.
+    Union states of the FSA get a state id when a column first leads to them."""
+
+    def __init__(self, fsa):
+        self.name = fsa.name
+        self.states = [fsa.states['S0']] + [s for n, s in fsa.states.items() if n != 'S0']
+        self.state_ids = {state: i for i, state in enumerate(self.states)}
+        self.classes = []
+        self.symbol_ids = {}
+        self.signature_ids = {}
+        # for each symbol id the token or the set of classes it stands for and
+        # an array with the target of each state
+        self.keys = []
+        self.columns = []
+        self.finals = bytearray()
+        self.lock = threading.Lock()
+        for state in self.states:
+            for token_class, target in state.class_transitions:
+                if token_class not in self.classes:
+                    self.classes.append(token_class)
+        keys = []
+        for state in self.states:
+            for symbol in state.transitions:
+                if symbol not in self.symbol_ids:
+                    self.symbol_ids[symbol] = len(keys)
+                    keys.append((symbol, None))
+        self.symbols = list(self.symbol_ids)
+        self.add_columns(keys, len(self.states))
+
+    def __str__(self):
+        return "<CompiledFSA with %d states and %d symbols>" % (
+            len(self.states), len(self.columns))
+
+    def add_columns(self, keys, new_states=0):
+        """Add a column for each (token, classes) pair, where the token is None for a
+        combination of classes and the classes are None for an exact symbol. The
+        last new_states states have no row yet. States that are reached for the
+        first time are added too. Nothing is visible to match() until all rows
+        and columns are complete, so matching can go on in other threads."""
+        states = list(self.states)
+        state_ids = dict(self.state_ids)
+
+        def target_id(state, key):
+            token, classes = key
+            target = state.next(token) if classes is None else state.next_in_classes(classes)
+            if target is None:
+                return -1
+            if target not in state_ids:
+                state_ids[target] = len(states)
+                states.append(target)
+            return state_ids[target]
+
+        old_states = len(states) - new_states
+        columns = [array('i', [target_id(states[i], key) for i in range(old_states)])
+                   for key in keys]
+        all_keys = self.keys + keys
+        rows = []
+        while old_states + len(rows) < len(states):
+            state = states[old_states + len(rows)]
+            rows.append([target_id(state, key) for key in all_keys])
+        for i, column in enumerate(self.columns + columns):
+            column.extend([row[i] for row in rows])
+        self.finals.extend(bytes((len(states) + 7) // 8 - len(self.finals)))
+        for i in range(old_states, len(states)):
+            if states[i].is_final:
+                self.finals[i >> 3] |= 1 << (i & 7)
+        self.states = states
+        self.state_ids = state_ids
+        self.keys.extend(keys)
+        self.columns.extend(columns)
+
+    def is_final(self, state):
+        return bool(self.finals[state >> 3] & (1 << (state & 7)))
+
+    def symbol_id(self, token):
+        """Return the symbol id of a token, or -1 if no transition can use it."""
+        symbol_id = self.symbol_ids.get(token)
+        if symbol_id is not None:
+            return symbol_id
+        if not self.classes:
+            return -1
+        signature = tuple(token_class.test(token) for token_class in self.classes)
+        if not any(signature):
+            return -1
+        with self.lock:
+            symbol_id = self.signature_ids.get(signature)
+            if symbol_id is None:
+                matching = set(c for c, in_class in zip(self.classes, signature) if in_class)
+                symbol_id = len(self.columns)
+                self.add_columns([(None, matching)])
+                self.signature_ids[signature] = symbol_id
+        return symbol_id
+
+    def intern(self, tokens):
+        """Return an array with the symbol id of each token, tokens that no transition
+        can use get -1. Takes a list of tokens or a TokenArrays instance, for the
+        latter only the types are looked up."""
+        if hasattr(tokens, 'ids'):
+            type_ids = array('i', map(self.symbol_id, tokens.types))
+            return array('i', map(type_ids.__getitem__, tokens.ids))
+        return array('i', map(self.symbol_id, tokens))
+
+    def match(self, ids, start=0):
+        """Return the end offset of the longest match that starts at the start offset
+        in an array of symbol ids, or None if there is no match."""
+        columns = self.columns
+        finals = self.finals
+        state = 0
+        end = None
+        for i in range(start, len(ids)):
+            symbol = ids[i]
+            if symbol < 0:
+                break
+            state = columns[symbol][state]
+            if state < 0:
+                break
+            if finals[state >> 3] & (1 << (state & 7)):
+                end = i + 1
+        return end
+
+    def scan(self, ids):
+        """Generate (start, end) pairs for the longest non-overlapping matches in an
+        array of symbol ids."""
+        i = 0
+        while i < len(ids):
+            end = self.match(ids, i)
+            if end is not None:
+                yield i, end
+                i = end
+            else:
+                i += 1
+
+
+class MultiFSA(object):
+
+    """A set of FSAs that is run over a sequence in one scan. The FSAs are combined
+    into one deterministic automaton whose states are sets of states of the
+    individual FSAs, at each offset a single walk through that automaton finds
+    the longest match of each FSA at that offset. States of the combined
+    automaton are created when they are first reached, so only the part that is
+    needed for the input is built. FSA names have to be unique."""
+
+    def __init__(self, fsas):
+        self.fsas = list(fsas)
+        self.names = [fsa.name for fsa in self.fsas]
+        self.multi_states = {}
+        self.start = self.multi_state([(i, fsa.states['S0']) for i, fsa in enumerate(self.fsas)])
+
+    def __str__(self):
+        return "<MultiFSA with %d FSAs and %d states>" % (len(self.fsas), len(self.multi_states))
+
+    def multi_state(self, members):
+        """Return the state for a list of (FSA index, state) pairs, creating it if
+        it did not exist yet."""
+        key = tuple((i, state.name) for i, state in members)
+        if key not in self.multi_states:
+            self.multi_states[key] = MultiState(members)
+        return self.multi_states[key]
+
+    def next_state(self, multi_state, symbol):
+        """Return the state reached from multi_state with symbol or None."""
+        if multi_state.transitions is None:
+            multi_state.expand(self)
+        target = multi_state.transitions.get(symbol)
+        if target is None and multi_state.classes:
+            target = multi_state.next_in_classes(self, symbol)
+        return target
+
+    def longest_matches(self, sequence, start=0):
+        """Return a dictionary with the end offset of the longest match of each FSA
+        that matches at the start offset, indexed on the index of the FSA."""
+        state = self.start
+        ends = {}
+        for i in range(start, len(sequence)):
+            state = self.next_state(state, sequence[i])
+            if state is None:
+                break
+            for fsa_index in state.finals:
+                ends[fsa_index] = i + 1
+        return ends
+
+    def scan(self, sequence):
+        """Generate (name, start, end) triples for the matches of all FSAs. For each
+        FSA these are the same longest, non-overlapping matches that a scan with
+        only that FSA would find. A walk through the combined automaton starts at
+        each offset, so this takes time proportional to the length of the
+        sequence times the average length of the walks. A walk stops as soon as
+        none of the FSAs can go on, so for a gazetteer it is never longer than
+        the longest entry and usually ends after the first token."""
+        next_positions = [0] * len(self.fsas)
+        for start in range(len(sequence)):
+            ends = self.longest_matches(sequence, start)
+            for fsa_index in sorted(ends):
+                if next_positions[fsa_index] <= start:
+                    next_positions[fsa_index] = ends[fsa_index]
+                    yield self.names[fsa_index], start, ends[fsa_index]
+
+
+class MultiState(object):
+
+    """A state of a MultiFSA, which is a list of (FSA index, state) pairs. The
+    transitions are computed when the state is first used. Transitions for tokens
+    that are not exact symbols of any of the states are indexed on the classes
+    the token is in and are only computed when such a token comes up."""
+
+    def __init__(self, members):
+        self.members = members
+        self.finals = tuple(i for i, state in members if state.is_final)
+        self.transitions = None
+        self.classes = []
+        self.class_targets = {}
+
+    def __str__(self):
+        return "<MultiState %s>" % ' '.join("%d:%s" % (i, s.name) for i, s in self.members)
+
+    def expand(self, multi_fsa):
+        """Compute the transitions on exact symbols. The exact transitions of the
+        members are indexed on symbol first, so a symbol only looks at the
+        members that have a transition on it, plus the members with token
+        classes, since those may also take the symbol."""
+        targets = {}
+        class_members = []
+        for i, state in self.members:
+            for symbol, target in state.transitions.items():
+                targets.setdefault(symbol, []).append((i, target))
+            if state.class_transitions:
+                class_members.append((i, state))
+                for token_class, target in state.class_transitions:
+                    if token_class not in self.classes:
+                        self.classes.append(token_class)
+        transitions = {}
+        for symbol, members in targets.items():
+            if class_members:
+                exact = set(i for i, target in members)
+                for i, state in class_members:
+                    if i not in exact:
+                        target = state.next(symbol)
+                        if target is not None:
+                            members.append((i, target))
+                members.sort(key=lambda member: member[0])
+            transitions[symbol] = multi_fsa.multi_state(members)
+        self.transitions = transitions
+
+    def next_in_classes(self, multi_fsa, token):
+        signature = tuple(token_class.test(token) for token_class in self.classes)
+        if not any(signature):
+            return None
+        if signature not in self.class_targets:
+            matching = set(c for c, in_class in zip(self.classes, signature) if in_class)
+            members = [(i, state.next_in_classes(matching)) for i, state in self.members]
+            members = [(i, target) for i, target in members if target is not None]
+            self.class_targets[signature] = multi_fsa.multi_state(members) if members else None
+        return self.class_targets[signature]
 
 
 class State(object):
 
-    """Each State has a name and a dictionary of transitions indexed on vocabulary
-    elements with names of states as values."""
+    """Each State has a name, a dictionary of transitions indexed on vocabulary
+    elements with states as values and a list of (token class, state) pairs for
+    transitions on token classes. The unions dictionary has the union states of
+    the FSA, it is shared by all its states."""
 
-    def __init__(self, name):
+    def __init__(self, name, unions=None):
         self.name = name
         self.transitions = {}
+        self.class_transitions = []
         self.is_final = False
+        self.unions = {} if unions is None else unions
+
+    def add_transition(self, label, target):
+        if isinstance(label, TokenClass):
+            self.class_transitions.append((label, target))
+        else:
+            self.transitions[label] = target
+
+    def items(self):
+        """Return all (label, state) pairs, exact transitions first."""
+        return list(self.transitions.items()) + self.class_transitions
+
+    def next(self, token):
+        """Return the state reached with the token or None. Exact transitions are
+        looked up first and the token classes are only tried if there is none. A
+        token that is in several of the classes goes to the union of their
+        targets."""
+        target = self.transitions.get(token)
+        if target is None and self.class_transitions:
+            targets = [state for token_class, state in self.class_transitions
+                       if token_class.test(token)]
+            return targets[0] if len(targets) == 1 else union_state(targets, self.unions)
+        return target
+
+    def next_in_classes(self, classes):
+        """Return the state reached with a token that is in the given set of classes
+        and that is not an exact symbol, or None."""
+        targets = [state for token_class, state in self.class_transitions
+                   if token_class in classes]
+        return targets[0] if len(targets) == 1 else union_state(targets, self.unions)
 
     def __str__(self):
         final =  ' f' if self.is_final else ''
         return "<State %s%s>" % (self.name, final)
 
 
+class UnionState(State):
+
+    """A state that stands for being in several states of an FSA at once, which is
+    where a token goes that is in more than one of the token classes of a state.
+    It has the class transitions of all its members, its exact transitions are
+    computed when they are first used."""
+
+    def __init__(self, members, unions):
+        self.name = '+'.join(state.name for state in members)
+        self.members = members
+        self.class_transitions = [t for state in members for t in state.class_transitions]
+        self.is_final = any(state.is_final for state in members)
+        self.unions = unions
+        self.exact = None
+
+    @property
+    def transitions(self):
+        if self.exact is None:
+            symbols = set(symbol for state in self.members for symbol in state.transitions)
+            self.exact = {symbol: union_state([state.next(symbol) for state in self.members],
+                                              self.unions)
+                          for symbol in symbols}
+        return self.exact
+
+
+def union_state(states, unions):
+    """Return the state for being in all of the states at once, which is the state
+    itself if there is only one and None if there are none. States can be None,
+    union states are replaced by their members. The union is taken from or added
+    to the unions dictionary, so there is only one for each set of states."""
+    members = set()
+    for state in states:
+        if isinstance(state, UnionState):
+            members.update(state.members)
+        elif state is not None:
+            members.add(state)
+    if len(members) < 2:
+        return members.pop() if members else None
+    key = frozenset(members)
+    union = unions.get(key)
+    if union is None:
+        members = sorted(members, key=lambda state: state.name)
+        union = unions.setdefault(key, UnionState(members, unions))
+    return union
+
+
+class Cursor(object):
+
+    """The state of one run of an FSA over a sequence: the position in the sequence,
+    the current state and the longest match so far."""
+
+    def __init__(self, fsa, sequence, start=0):
+        self.fsa = fsa
+        self.sequence = sequence
+        self.start = start
+        self.position = start
+        self.current_state = fsa.states['S0']
+        # storing the longest match if there is a match
+        self.match = False
+
+    def __str__(self):
+        return "<Cursor %s %d>" % (self.current_state, self.position)
+
+    def step(self):
+        """Consume the next element of the sequence, returns False if that is not
+        possible."""
+        if self.position >= len(self.sequence):
+            return False
+        next_state = self.current_state.next(self.sequence[self.position])
+        if next_state is None:
+            return False
+        self.current_state = next_state
+        self.position += 1
+        if next_state.is_final:
+            self.match = Match(self.sequence, self.start, self.position)
+        return True
+
+    def run(self, debug=False):
+        self.print_state(indent=3, debug=debug)
+        while self.step():
+            self.print_state(indent=3, debug=debug)
+
+    def print_state(self, indent=0, debug=True):
+        if debug:
+            consumed = self.sequence[self.start:self.position]
+            queue = self.sequence[self.position:self.position + 5]
+            print("%s%s %s . %s" % (' ' * indent, self.current_state,
+                                    ' '.join(consumed), ' '.join(queue)))
+
+
 class Match(object):
 
-    """The Match object is initialized from an FSA and simply keeps a copy of the
-    sequence consumed."""
+    """The Match object keeps the sequence and the offsets of the match in it, the
+    consumed elements are only copied out of the sequence when they are asked
+    for."""
     
-    def __init__(self, fsa):
-        self.consumed = fsa.consumed[:]
+    def __init__(self, sequence, start, end):
+        self.sequence = sequence
+        self.start = start
+        self.end = end
+
+    @property
+    def consumed(self):
+        return list(self.sequence[self.start:self.end])
         
     def __str__(self):
         return ' '.join(self.consumed)
     
     def __len__(self):
-        return len(self.consumed)
+        return self.end - self.start
+
+
+### Token classes
+
+class TokenClass(object):
+
+    """A class of tokens that a transition can be on. Subclasses define test(),
+    which takes a token and returns True if the token is in the class. Tokens are
+    strings or, for tagged text, (word, tag) pairs. Two classes are equal if they
+    are of the same kind and have the same value, so they can be used as keys."""
+
+    kind = None
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.value == other.value
+
+    def __hash__(self):
+        return hash((self.kind, self.value))
+
+    def __str__(self):
+        return "<%s:%s>" % (self.kind, self.value)
+
+    __repr__ = __str__
+
+    def test(self, token):
+        raise NotImplementedError()
+
+
+class AnyToken(TokenClass):
+
+    kind = 'any'
+
+    def __init__(self):
+        TokenClass.__init__(self, None)
+
+    def __str__(self):
+        return "<any>"
+
+    __repr__ = __str__
+
+    def test(self, token):
+        return True
+
+
+class Regex(TokenClass):
+
+    """Tokens whose word matches a regular expression completely."""
+
+    kind = 're'
+
+    def __init__(self, value):
+        TokenClass.__init__(self, value)
+        self.regex = re.compile(value)
+
+    def test(self, token):
+        return self.regex.fullmatch(token_word(token)) is not None
+
+
+class Lower(TokenClass):
+
+    """Tokens whose word is the value when lower cased."""
+
+    kind = 'lower'
+
+    def __init__(self, value):
+        TokenClass.__init__(self, value.lower())
+
+    def test(self, token):
+        return token_word(token).lower() == self.value
+
+
+class Tag(TokenClass):
+
+    """Tagged tokens with the tag."""
+
+    kind = 'tag'
+
+    def test(self, token):
+        return not isinstance(token, str) and token[1] == self.value
+
+
+class Predicate(TokenClass):
+
+    """Tokens for which a function returns True, the name defaults to the name of
+    the function."""
+
+    kind = 'pred'
+
+    def __init__(self, function, name=None):
+        TokenClass.__init__(self, function)
+        self.name = function.__name__ if name is None else name
+
+    def __str__(self):
+        return "<%s>" % self.name
+
+    __repr__ = __str__
+
+    def test(self, token):
+        return bool(self.value(token))
+
+
+def token_word(token):
+    """Return the word of a token, which is the token itself unless it is tagged."""
+    return token if isinstance(token, str) else token[0]
+
+
+def make_class(text, predicates=None):
+    """Return the token class for the text between angle brackets in a regular
+    expression."""
+    kind, _, value = text.partition(':')
+    if text == 'any':
+        return AnyToken()
+    elif kind == 're' and value:
+        return Regex(value)
+    elif kind == 'lower' and value:
+        return Lower(value)
+    elif kind == 'tag' and value:
+        return Tag(value)
+    elif predicates and text in predicates:
+        return Predicate(predicates[text], text)
+    raise ValueError("unknown token class <%s>" % text)
+
+
+def label_key(label):
+    """Sort key for transition labels, which can be tokens or token classes."""
+    return (isinstance(label, TokenClass), str(label))
+
+
+### Token regular expressions
+
+def lex_regex(pattern, predicates=None):
+    """Return a list of (kind, value) pairs for a token regular expression, where
+    kind is 'op' for operators and 'sym' for tokens and token classes."""
+    lexemes = []
+    symbol = None
+    chars = iter(pattern)
+    for char in chars:
+        if char == '<':
+            if symbol is not None:
+                lexemes.append(('sym', symbol))
+                symbol = None
+            lexemes.append(('sym', make_class(lex_class(chars, pattern), predicates)))
+            continue
+        if char == '\\':
+            char = next(chars, None)
+            if char is None:
+                raise ValueError("pattern ends with a backslash: %r" % pattern)
+            symbol = (symbol or '') + char
+            continue
+        if char.isspace() or char in OPERATORS:
+            if symbol is not None:
+                lexemes.append(('sym', symbol))
+                symbol = None
+            if char in OPERATORS:
+                lexemes.append(('op', char))
+        else:
+            symbol = (symbol or '') + char
+    if symbol is not None:
+        lexemes.append(('sym', symbol))
+    return lexemes
+
+
+def lex_class(chars, pattern):
+    """Return the text up to the closing angle bracket, a backslash only escapes the
+    closing bracket so that regular expressions can be used as they are."""
+    text = ''
+    for char in chars:
+        if char == '>':
+            return text
+        if char == '\\':
+            char = next(chars, '')
+            text += char if char == '>' else '\\' + char
+        else:
+            text += char
+    raise ValueError("missing closing angle bracket in %r" % pattern)
+
+
+def parse_regex(pattern, predicates=None):
+    """Parse a token regular expression into a tree of nested tuples, where the first
+    element is one of 'sym', 'cat', 'alt', 'star', 'plus' and 'opt'."""
+    lexemes = lex_regex(pattern, predicates)
+    position = 0
+
+    def peek():
+        return lexemes[position] if position < len(lexemes) else (None, None)
+
+    def alternation():
+        nonlocal position
+        branches = [concatenation()]
+        while peek() == ('op', '|'):
+            position += 1
+            branches.append(concatenation())
+        return branches[0] if len(branches) == 1 else ('alt', branches)
+
+    def concatenation():
+        parts = []
+        while peek()[0] == 'sym' or peek() == ('op', '('):
+            parts.append(repetition())
+        return parts[0] if len(parts) == 1 else ('cat', parts)
+
+    def repetition():
+        nonlocal position
+        tree = atom()
+        while peek()[0] == 'op' and peek()[1] in '*+?':
+            tree = ({'*': 'star', '+': 'plus', '?': 'opt'}[peek()[1]], tree)
+            position += 1
+        return tree
+
+    def atom():
+        nonlocal position
+        kind, value = peek()
+        position += 1
+        if kind == 'sym':
+            return ('sym', value)
+        tree = alternation()
+        if peek() != ('op', ')'):
+            raise ValueError("missing closing parenthesis in %r" % pattern)
+        position += 1
+        return tree
+
+    tree = alternation()
+    if position < len(lexemes):
+        raise ValueError("unexpected %r in %r" % (lexemes[position][1], pattern))
+    return tree
+
+
+class NFA(object):
+
+    """Non-deterministic automaton with integer states and empty transitions, built
+    from a parse tree with Thompson's construction. It has one start state and
+    one final state."""
+
+    def __init__(self):
+        self.epsilons = []
+        self.transitions = []
+
+    @classmethod
+    def from_tree(cls, tree):
+        nfa = cls()
+        nfa.start, nfa.final = nfa.build(tree)
+        return nfa
+
+    def new_state(self):
+        self.epsilons.append([])
+        self.transitions.append({})
+        return len(self.epsilons) - 1
+
+    def build(self, tree):
+        """Add the states for the tree and return its start and final state."""
+        kind = tree[0]
+        start = self.new_state()
+        if kind == 'sym':
+            final = self.new_state()
+            self.transitions[start].setdefault(tree[1], []).append(final)
+        elif kind == 'cat':
+            final = start
+            for part in tree[1]:
+                part_start, part_final = self.build(part)
+                self.epsilons[final].append(part_start)
+                final = part_final
+        elif kind == 'alt':
+            final = self.new_state()
+            for branch in tree[1]:
+                branch_start, branch_final = self.build(branch)
+                self.epsilons[start].append(branch_start)
+                self.epsilons[branch_final].append(final)
+        else:
+            final = self.new_state()
+            inner_start, inner_final = self.build(tree[1])
+            self.epsilons[start].append(inner_start)
+            self.epsilons[inner_final].append(final)
+            if kind in ('star', 'opt'):
+                self.epsilons[start].append(final)
+            if kind in ('star', 'plus'):
+                self.epsilons[inner_final].append(inner_start)
+        return start, final
+
+    def closure(self, states):
+        """Return the states reachable from the states with empty transitions."""
+        result = set(states)
+        stack = list(states)
+        while stack:
+            for target in self.epsilons[stack.pop()]:
+                if target not in result:
+                    result.add(target)
+                    stack.append(target)
+        return frozenset(result)
+
+
+def determinize(nfa):
+    """Subset construction. Returns the number of states of the deterministic
+    automaton, its final states and a dictionary with for each state a dictionary
+    of transitions, states are integers with 0 as the start state. Transitions on
+    exact symbols also go where the token classes that the symbol is in go. Token
+    classes may overlap, a token that is in several of them goes to the union of
+    their targets when the automaton is run (see UnionState)."""
+    start = nfa.closure([nfa.start])
+    state_ids = {start: 0}
+    queue = [start]
+    finals = set()
+    transitions = {}
+    while queue:
+        subset = queue.pop()
+        state = state_ids[subset]
+        if nfa.final in subset:
+            finals.add(state)
+        targets = {}
+        class_targets = {}
+        for nfa_state in subset:
+            for label, nfa_targets in nfa.transitions[nfa_state].items():
+                table = class_targets if isinstance(label, TokenClass) else targets
+                table.setdefault(label, set()).update(nfa_targets)
+        for symbol, nfa_targets in list(targets.items()):
+            class_nfa_targets = set()
+            for token_class in class_targets:
+                if token_class.test(symbol):
+                    class_nfa_targets.update(class_targets[token_class])
+            if not class_nfa_targets:
+                continue
+            # drop the exact transition if the classes already do the same
+            if class_nfa_targets >= nfa_targets:
+                del targets[symbol]
+            else:
+                nfa_targets.update(class_nfa_targets)
+        targets.update(class_targets)
+        transitions[state] = {}
+        for symbol, nfa_targets in targets.items():
+            target = nfa.closure(nfa_targets)
+            if target not in state_ids:
+                state_ids[target] = len(state_ids)
+                queue.append(target)
+            transitions[state][symbol] = state_ids[target]
+    return len(state_ids), finals, transitions
+
+
+def minimize(size, finals, transitions):
+    """Minimize a deterministic automaton as returned by determinize() with
+    Hopcroft's algorithm and return the states, final states and transitions in
+    the form that the FSA class takes. Missing transitions go to an implicit dead
+    state, which is left out of the result."""
+    dead = size
+    symbols = sorted(set(symbol for row in transitions.values() for symbol in row), key=label_key)
+    # inverse transitions, including those to and from the dead state
+    inverse = {symbol: {} for symbol in symbols}
+    for state in range(size + 1):
+        row = transitions.get(state, {})
+        for symbol in symbols:
+            inverse[symbol].setdefault(row.get(symbol, dead), set()).add(state)
+    non_finals = set(range(size + 1)) - finals
+    partition = [block for block in (set(finals), non_finals) if block]
+    work = [block for block in partition]
+    while work:
+        splitter = work.pop()
+        for symbol in symbols:
+            predecessors = set()
+            for state in splitter:
+                predecessors.update(inverse[symbol].get(state, ()))
+            if not predecessors:
+                continue
+            refined = []
+            for block in partition:
+                inside = block & predecessors
+                outside = block - predecessors
+                if inside and outside:
+                    refined.extend([inside, outside])
+                    if block in work:
+                        work.remove(block)
+                        work.extend([inside, outside])
+                    else:
+                        work.append(min(inside, outside, key=len))
+                else:
+                    refined.append(block)
+            partition = refined
+    block_of = {state: i for i, block in enumerate(partition) for state in block}
+    # name the blocks in the order they are reached from the start state
+    names = {block_of[0]: 'S0'}
+    queue = [block_of[0]]
+    result = []
+    while queue:
+        block = queue.pop(0)
+        state = next(iter(partition[block]))
+        row = transitions.get(state, {})
+        classes = [label for label in row if isinstance(label, TokenClass)]
+        for symbol, target in sorted(row.items(), key=lambda t: label_key(t[0])):
+            target_block = block_of[target]
+            if target_block == block_of[dead]:
+                continue
+            # leave out exact transitions that a class transition already does
+            if symbol not in classes and any(block_of[row[c]] == target_block
+                                             for c in classes if c.test(symbol)):
+                continue
+            if target_block not in names:
+                names[target_block] = 'S%d' % len(names)
+                queue.append(target_block)
+            result.append((names[block], symbol, names[target_block]))
+    states = sorted(names.values(), key=lambda name: int(name[1:]))
+    final_states = [names[block_of[state]] for state in finals if block_of[state] in names]
+    return states, sorted(set(final_states)), result
 
 
 if __name__ == '__main__':
@@ -115,3 +965,6 @@ if __name__ == '__main__':
 
     print("\nConsuming as much as possible from abbcd...\n")
     fsa_abc.consume('abbcd', debug=True)
+
+    print("\nCompiling 'Sir (Robin|Galahad)+ the? Brave'...\n")
+    FSA.from_regex('sirs', 'Sir (Robin|Galahad)+ the? Brave').pp()
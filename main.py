@@ -4,22 +4,31 @@ Example Text Analysis code after assignment 2.
 
 """
 
-import os
+import sys
 import math
+import zlib
+import weakref
+from array import array
+from itertools import chain, repeat, accumulate
+from operator import add, mul, truediv
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 import nltk
 from nltk.corpus import brown
 from nltk.corpus import wordnet as wn
-from nltk.corpus import PlaintextCorpusReader
 from nltk.probability import FreqDist
 from nltk.text import Text
 
+from reader import read_raw, source_files, TokenStream
+from cache import load_tokens, tokenize, read_arrays, write_arrays
+from concordance import PositionalIndex
+from textstats import TextStatistics
 
-# NLTK stoplist with 3136 words (multilingual)
-STOPLIST = set(nltk.corpus.stopwords.words())
+# NLTK stoplist with 3136 words (multilingual) and vocabulary with 234,377
+# English words from NLTK, both are loaded on first use
+from resources import STOPLIST, ENGLISH_VOCABULARY
 
-# Vocabulary with 234,377 English words from NLTK
-ENGLISH_VOCABULARY = set(w.lower() for w in nltk.corpus.words.words())
 
 # The five categories from Brown that we are using
 BROWN_CATEGORIES = ('adventure', 'fiction', 'government', 'humor', 'news')
@@ -27,39 +36,76 @@ BROWN_CATEGORIES = ('adventure', 'fiction', 'government', 'humor', 'news')
 # Global place to store Brown vocabularies so you calculate them only once
 BROWN_VOCABULARIES = None
 
+# And the same for the models built from those vocabularies, indexed on the
+# names created by model_name()
+BROWN_MODELS = {}
+
+# The compiled Brown models, one for each weight and set of dimension options,
+# and their version, bump the version when the way models are built changes so
+# that old files are not used
+COMPILED_BROWN_MODEL = 'brown-categories-%s.model'
+MODEL_VERSION = 4
+
+# Vector weights and the parameters for BM25
+WEIGHTS = ('frequency', 'binary', 'log', 'tfidf', 'bm25')
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Statistics for texts, the entry for a text goes away with the text
+STATISTICS = weakref.WeakKeyDictionary()
+
 
 ### PART 1: reading source data
 
-def read_text(path):
+def read_text(path, stream=False, cache=True):
     """Takes a file path, which is assumed to point to a file or a directory,
-    and returns a Text instance."""
-    if os.path.isfile(path):
-        with open(path) as fh:
-            return Text(nltk.word_tokenize(fh.read()))
-    elif os.path.isdir(path):
-        # restrict to files with the mrg extension, avoiding hidden files like .DS_Store
-        # that can cause trouble
-        corpus = PlaintextCorpusReader(path, '.*.mrg')
-        return Text(nltk.word_tokenize(corpus.raw()))
+    and returns a Text instance. With stream=True a TokenStream is returned
+    instead, which reads and tokenizes the source lazily in chunks and which can
+    be handed to the statistics functions below. Unless cache=False, tokens are
+    taken from the tokenization cache if they are there, and a text that is not
+    streamed is added to the cache."""
+    if stream:
+        tokens = load_tokens(path) if cache else None
+        return TokenStream(path) if tokens is None else tokens
+    if cache:
+        tokens = tokenize(path)
+        return None if tokens is None else Text(tokens)
+    raw = read_raw(path)
+    if raw is not None:
+        return Text(nltk.word_tokenize(raw))
 
 
 ### PART 2: simple statistics
 
 # Total number of sentences, word types and word tokens
 
+# All these take a Text or any other iterable over tokens, including a
+# TokenStream. They are served from a TextStatistics instance that collects all
+# statistics in one pass and that is cached for texts that allow weak
+# references (instances of Text and TokenStream do, lists do not).
+
+def text_statistics(text):
+    """Return the statistics for the text, calculating them only once."""
+    try:
+        return STATISTICS[text]
+    except TypeError:
+        return TextStatistics(text, is_content_word)
+    except KeyError:
+        STATISTICS[text] = TextStatistics(text, is_content_word)
+        return STATISTICS[text]
+
 def token_count(text):
     """Just return all tokens."""
-    return len(text)
+    return text_statistics(text).tokens
 
 def type_count(text):
     """Returns the type count, with minimal normalization by lower casing."""
-    # an alternative would be to use the method nltk.text.Text.vocab()
-    return len(set([w.lower() for w in text]))
+    return text_statistics(text).types
 
 def sentence_count(text):
     """Return number of sentences, using the simplistic measure of counting period,
     exclamation marks and question marks."""
-    return len([t for t in text if t in ('.', '!', '?')])
+    return text_statistics(text).sentences
 
 def is_content_word(word):
     """A content word is not on the stoplist and its first character is a letter."""
@@ -69,18 +115,14 @@ def most_frequent_content_words(text):
     """Return a list with the 25 most frequent content words and their
     frequencies. The list has (word, frequency) pairs and is ordered on the
     frequency."""
-    dist = FreqDist([w for w in text if is_content_word(w)])
-    return dist.most_common(n=25)
+    return text_statistics(text).most_frequent_content_words(n=25)
 
 def most_frequent_bigrams(text):
     """Return a list with the 25 most frequent bigrams that only contain
     content words. The list returned should have pairs where the first
     element in the pair is the bigram and the second the frequency, as in
     ((word1, word2), frequency), these should be ordered on frequency."""
-    filtered_bigrams = [b for b in list(nltk.bigrams(text))
-                        if is_content_word(b[0]) and is_content_word(b[1])]
-    dist = nltk.FreqDist([b for b in filtered_bigrams])
-    return dist.most_common(n=25)
+    return text_statistics(text).most_frequent_bigrams(n=25)
 
 
 ### PART 3: Vocabulary
@@ -93,17 +135,25 @@ class Vocabulary():
     vocabulary and the text. We do not store POS and gloss, for those we rely on
     WordNet. The vocabulary is contrained to those words that occur in a
     standard word list. Vocabulary items are not normalized, except for being in
-    lower case."""
+    lower case.
 
-    def __init__(self, text):
+    A vocabulary can also be created from the counts of the lower cased tokens
+    of a text, for example when the text was counted in another process. The
+    text is then only used for kwic and can be a streamed text from read_text(),
+    which is not read until a concordance is asked for."""
+
+    def __init__(self, text, counts=None):
         self.text = text
+        if counts is None:
+            counts = FreqDist(w.lower() for w in text)
         # keeping the unfiltered list around for statistics
-        self.all_items = set([w.lower() for w in text])
-        self.items = self.all_items.intersection(ENGLISH_VOCABULARY)
+        self.all_items = set(counts)
+        self.items = self.all_items & ENGLISH_VOCABULARY
         # restricting the frequency dictionary to vocabulary items
-        self.fdist = FreqDist(t.lower() for t in text if t.lower() in self.items)
-        self.text_size = len(self.text)
+        self.fdist = FreqDist({w: c for w, c in counts.items() if w in self.items})
+        self.text_size = counts.N()
         self.vocab_size = len(self.items)
+        self.positions = None
 
     def __str__(self):
         return "<Vocabulary size=%d text_size=%d>" % (self.vocab_size, self.text_size)
@@ -132,8 +182,17 @@ class Vocabulary():
         # in the vocabulary that do not have a gloss in WordNet
         return synsets[0].definition() if synsets else 'NO DEFINITION'
 
-    def kwic(self, word):
-        self.text.concordance(word)
+    def kwic(self, word, width=79, lines=25):
+        """Print a concordance for the word, using a positional index on the text
+        that is created the first time this is called."""
+        if self.positions is None:
+            if self.text is None:
+                raise ValueError("this vocabulary has no text to create a kwic from")
+            tokens = self.text.tokens if isinstance(self.text, Text) else self.text
+            if isinstance(tokens, TokenStream):
+                tokens = list(tokens)
+            self.positions = PositionalIndex.from_tokens(tokens)
+        self.positions.print_kwic(word, width, lines)
 
 
 ### PART 4: comparison to Brown
@@ -146,12 +205,39 @@ def get_category_vocabs(categories):
         vocabs[cat] = Vocabulary(Text(words))
     return vocabs
 
-def get_text_vocabs():
+def get_text_vocabs(workers=None):
     """Returns a dictionary of vocabularies indexed on category names."""
-    return {
-        'grail': Vocabulary(read_text('data/grail.txt')),
-        'emma': Vocabulary(read_text('data/emma.txt')),
-        'wsj': Vocabulary(read_text('data/wsj')) }
+    return get_corpus_vocabs(
+        {'grail': 'data/grail.txt', 'emma': 'data/emma.txt', 'wsj': 'data/wsj'},
+        workers=workers)
+
+def get_corpus_vocabs(paths, workers=None):
+    """Takes a dictionary of file or directory paths indexed on names and returns a
+    dictionary of vocabularies indexed on the same names. Each file (including each
+    file in a directory) is tokenized and counted in a separate process, using at
+    most the given number of worker processes (the default is the number of CPUs,
+    with workers=1 no processes are started). The counts for a path are merged in
+    the order of the files, so the result does not depend on which process
+    finishes first. The text of each vocabulary is the streamed text of the
+    path, which is only read when the vocabulary needs it for kwic()."""
+    jobs = [(name, filename) for name, path in paths.items()
+            for filename in source_files(path)]
+    filenames = [filename for name, filename in jobs]
+    if workers == 1:
+        all_counts = map(count_tokens, filenames)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            all_counts = list(executor.map(count_tokens, filenames))
+    merged = {name: FreqDist() for name in paths}
+    for (name, filename), counts in zip(jobs, all_counts):
+        merged[name].update(counts)
+    return {name: Vocabulary(read_text(path, stream=True), counts=merged[name])
+            for name, path in paths.items()}
+
+def count_tokens(filename):
+    """Return a FreqDist with the counts of the lower cased tokens in a file. The
+    file is streamed, so a worker never holds more than a chunk of its text."""
+    return FreqDist(w.lower() for w in read_text(filename, stream=True))
 
 def print_vocabs(text_vocabs, category_vocabs):
     # helper function so we can see what we did
@@ -161,72 +247,219 @@ def print_vocabs(text_vocabs, category_vocabs):
     for cat in category_vocabs:
         print("%-10s  %s" % (cat, category_vocabs[cat]))
 
-def get_dimensions(category_vocabs, debug=False):
+def get_dimensions(category_vocabs, debug=False, content_words=False, min_df=1,
+                   top_k=None, buckets=None):
     """Get the dimensions from the category vocabularies by collecting all elements
     in the vocabularies. Return the dimensions as a sorted list, with fixed
-    positions for each dimension (word)."""
+    positions for each dimension (word).
+
+    The number of dimensions can be limited by only keeping content words, by
+    only keeping words that occur in at least min_df vocabularies and by only
+    keeping the top_k words with the highest frequency over all vocabularies,
+    in that order. Alternatively, with buckets=n, words are hashed into n
+    dimensions and a HashedDimensions instance is returned instead of a list,
+    the other options are then ignored."""
+    if buckets is not None:
+        return HashedDimensions(buckets)
     dimensions = set()
+    df = Counter()
     for cat, vocab in category_vocabs.items():
         # add elements from the vocabulary
         dimensions.update(vocab.items)
+        df.update(vocab.items)
         if debug:
             print("%-12s %6d %6d" % (cat, len(vocab), len(dimensions)))
+    if content_words:
+        dimensions = set(w for w in dimensions if is_content_word(w))
+    if min_df > 1:
+        dimensions = set(w for w in dimensions if df[w] >= min_df)
+    if top_k is not None:
+        totals = Counter()
+        for vocab in category_vocabs.values():
+            totals.update(vocab.fdist)
+        # sort on word too so that ties are always broken the same way
+        ranked = sorted(dimensions, key=lambda w: (-totals[w], w))
+        dimensions = ranked[:top_k]
+    if debug:
+        print("%-12s %6s %6d" % ('pruned', '', len(dimensions)))
     return sorted(dimensions)
 
 
+class HashedDimensions(object):
+
+    """A fixed number of dimensions where each word is assigned to a dimension by
+    hashing it, so different words can share a dimension. This acts both as the
+    dimensions and as their index, see dimension_index(). We use crc32 rather
+    than hash() because the latter is different for each Python process."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def __str__(self):
+        return "<HashedDimensions buckets=%d>" % self.buckets
+
+    def __len__(self):
+        return self.buckets
+
+    def __eq__(self, other):
+        return isinstance(other, HashedDimensions) and self.buckets == other.buckets
+
+    def get(self, word, default=None):
+        return zlib.crc32(word.encode('utf-8')) % self.buckets
+
+
+def dimension_index(dimensions):
+    """Return a dictionary that maps each dimension (word) on its position. Takes
+    the sorted list from get_dimensions(), a dictionary or hashed dimensions are
+    returned unchanged so the index can be created once and shared by many
+    vectors."""
+    if isinstance(dimensions, (dict, HashedDimensions)):
+        return dimensions
+    return {word: i for i, word in enumerate(dimensions)}
+
+
 class Vector(object):
 
     """Vector object initialized from an instance of Vocabulary where the weights
-    are either raw frequencies or binary. Implements the cosine measure.
+    are raw frequencies, binary, sublinear frequencies (1 + log(tf)), tf-idf or
+    BM25 scores, see weigh(). Implements the cosine measure.
 
     Vectors are created from vocabularies, but that is not the only choice since
     you could also create them from instances of nltk.text.Text or even directly
     from the result of nltk.word_tokenize(). It is also quite alright to
-    implement vectors simply as lists and hand lists to the cosine method."""
-
-    def __init__(self, dimensions, vocabulary, weight="frequency"):
-        """Initialize from a Vocabulary instance."""
+    implement vectors simply as lists and hand lists to the cosine method.
+
+    Vectors are sparse: the data are a dictionary from dimension positions to
+    weights that only has the non-zero weights, so the size of a vector depends
+    on the size of the vocabulary and not on the number of dimensions. The
+    magnitude is calculated once and the dot product only looks at the non-zero
+    weights of the smaller vector, with all loops done by map() and sum()."""
+
+    def __init__(self, dimensions, vocabulary, weight="frequency", idf=None, avgdl=None):
+        """Initialize from a Vocabulary instance. The dimensions can be a list or a
+        dictionary created by dimension_index(). For tf-idf and BM25 you also need
+        the idf table and for BM25 the average document length, both are kept on
+        a CategoryModel."""
         self.weight = weight
-        self.data = [0] * len(dimensions)
-        for i, word in enumerate(dimensions):
-            if weight == 'frequency':
-                self.data[i] = vocabulary.fdist[word]
-            elif weight == 'binary':
-                self.data[i] = 1 if vocabulary.fdist[word] > 0 else 0
-        self.length = len(self.data)
-        self.sum = sum(self.data)
+        self.length = len(dimensions)
+        index = dimension_index(dimensions)
+        counts = {}
+        for word, count in vocabulary.fdist.items():
+            i = index.get(word)
+            if i is not None and count > 0:
+                # with hashed dimensions words can end up in the same dimension
+                counts[i] = counts.get(i, 0) + count
+        self.data = weigh(counts, weight, idf, vocabulary.fdist.N(), avgdl)
+        self.update()
+
+    def update(self):
+        """Recalculate the sum and the magnitude."""
+        values = self.data.values()
+        self.sum = sum(values)
+        self.magnitude = math.sqrt(sum(map(mul, values, values)))
 
     def __str__(self):
         return "<Vector weight=%s dimensions=%d sum=%d>" % (self.weight, self.length, self.sum)
 
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        # this gives all weights, including the zeros
+        return (self.data.get(i, 0) for i in range(self.length))
+
+    def position(self, key):
+        """Return the dimension position for an index, which can be negative like a
+        list index."""
+        position = key + self.length if key < 0 else key
+        if not 0 <= position < self.length:
+            raise IndexError(key)
+        return position
+
     def __getitem__(self, key):
-        return self.data[key]
+        return self.data.get(self.position(key), 0)
 
     def __setitem__(self, key, value):
-        self.data[key] = value
+        key = self.position(key)
+        if value:
+            self.data[key] = value
+        else:
+            self.data.pop(key, None)
+        self.update()
+
+    def dot(self, other):
+        return dot(self.data, other.data)
 
     def cosine(self, other, debug=False):
-        dot_product = sum([w1 * w2 for  w1, w2 in zip(self, other)])
-        magnitude_v1 = math.sqrt(sum([c**2 for c in self]))
-        magnitude_v2 = math.sqrt(sum([c**2 for c in other]))
+        dot_product = self.dot(other)
+        magnitude_v1 = self.magnitude
+        magnitude_v2 = other.magnitude
         if debug:
             print("%.2f %.2f %.2f" % (dot_product, magnitude_v1, magnitude_v2))
         cosine = dot_product / (magnitude_v1 * magnitude_v2)
         return cosine
 
 
-def create_category_vectors(dimensions, category_vocabs, weight='frequency'):
+def weigh(counts, weight, idf=None, length=None, avgdl=None):
+    """Takes a dictionary of term frequencies indexed on dimension positions and
+    returns a dictionary with weights. For tf-idf and BM25 the idf argument is a
+    sequence with the idf of each dimension, see get_idf(), BM25 also needs the
+    length of the document and the average document length. All loops are done
+    with map()."""
+    if weight not in WEIGHTS:
+        raise ValueError("unknown weight: %s" % weight)
+    if weight in ('tfidf', 'bm25') and idf is None:
+        raise ValueError("the %s weight needs an idf table, see get_idf()" % weight)
+    keys = counts.keys()
+    tfs = counts.values()
+    if weight == 'frequency':
+        return dict(counts)
+    elif weight == 'binary':
+        return dict.fromkeys(keys, 1)
+    elif weight == 'log':
+        return dict(zip(keys, map(sublinear_tf, tfs)))
+    idfs = map(idf.__getitem__, keys)
+    if weight == 'tfidf':
+        weights = map(mul, tfs, idfs)
+    elif weight == 'bm25':
+        # saturate the term frequency and normalize for document length
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl) if avgdl else BM25_K1
+        saturated = map(truediv, map(mul, tfs, repeat(BM25_K1 + 1)),
+                        map(add, tfs, repeat(norm)))
+        weights = map(mul, saturated, idfs)
+    # with tf-idf a term that occurs in all categories has weight zero
+    return {i: w for i, w in zip(keys, weights) if w}
+
+def sublinear_tf(tf):
+    return 1 + math.log(tf)
+
+def get_idf(category_vectors, length, weight='tfidf'):
+    """Return an array with the idf of each dimension, calculated from the
+    document frequencies of the dimensions in the category vectors (where each
+    category counts as a document). For BM25 the Lucene variant of the idf is
+    used, which is never negative."""
+    n = len(category_vectors)
+    df = Counter(chain.from_iterable(v.data.keys() for v in category_vectors.values()))
+    dfs = map(df.__getitem__, range(length))
+    if weight == 'bm25':
+        return array('d', (math.log((n - d + 0.5) / (d + 0.5) + 1) for d in dfs))
+    return array('d', (math.log(n / d) if d else 0.0 for d in dfs))
+
+def create_category_vectors(dimensions, category_vocabs, weight='frequency',
+                            idf=None, avgdl=None):
     category_vectors = {}
+    index = dimension_index(dimensions)
     for cat, vocab in category_vocabs.items():
-        vector = Vector(dimensions, vocab, weight=weight)
+        vector = Vector(index, vocab, weight=weight, idf=idf, avgdl=avgdl)
         #print(vocab, vector)
         category_vectors[cat] = vector
     return category_vectors
 
-def create_text_vectors(dimensions, text_vocabs, weight='frequency'):
+def create_text_vectors(dimensions, text_vocabs, weight='frequency', idf=None, avgdl=None):
     vectors = {}
+    index = dimension_index(dimensions)
     for text_name in text_vocabs:
-        vectors[text_name] = Vector(dimensions, text_vocabs[text_name], weight)
+        vectors[text_name] = Vector(index, text_vocabs[text_name], weight, idf, avgdl)
     return vectors
 
 def print_vectors(text_vectors, category_vectors):
@@ -237,26 +470,218 @@ def print_vectors(text_vectors, category_vectors):
         print("%-12s %s" % (name, category_vectors[name]))
 
 
-def compare_to_brown(text):
-    """Compare the text to the five categories from Brown and print the similarity
-    scores using the cosine measure."""
+class CategoryModel(object):
+
+    """A set of reference vocabularies, like the Brown categories, turned into
+    vectors once so that any number of texts can be compared to them. The model
+    keeps a TermMatrix with the normalized vectors (weights divided by the
+    magnitude) as columns, so that the cosines of a text with all categories are
+    found in one pass over the terms of the text. For tf-idf and BM25 weights the
+    model also has the idf table of the dimensions and the average length of the
+    categories, these are used for text vectors too.
+
+    A model can be saved to a file and loaded again, which is much faster than
+    creating it from the vocabularies. The file is written by write_arrays() and
+    has the dimensions, the idf table and the three arrays of the matrix. Loading
+    memory-maps the file and uses the idf table and the matrix as they are in the
+    file, only the dimensions are read into memory. A loaded model does not have
+    the category vectors, a model created from vocabularies has them in
+    self.vectors."""
+
+    def __init__(self, dimensions, categories, matrix, weight='frequency', idf=None,
+                 avgdl=None, options=None):
+        """Initialize from a list of dimensions, a list of category names and a
+        TermMatrix with a column for each category. The options are those handed
+        to get_dimensions()."""
+        self.weight = weight
+        self.options = options or {}
+        self.categories = categories
+        self.dimensions = dimensions
+        self.index = dimension_index(self.dimensions)
+        self.matrix = matrix
+        self.idf = idf
+        self.avgdl = avgdl
+        self.vectors = None
+
+    @classmethod
+    def from_vocabularies(cls, category_vocabs, weight='frequency', **options):
+        """Create a model, using the options to limit the dimensions."""
+        dimensions = get_dimensions(category_vocabs, **options)
+        index = dimension_index(dimensions)
+        idf = avgdl = None
+        if weight in ('tfidf', 'bm25'):
+            # document frequencies only need to know which terms occur
+            binary = create_category_vectors(index, category_vocabs, 'binary')
+            idf = get_idf(binary, len(dimensions), weight)
+            lengths = [vocab.fdist.N() for vocab in category_vocabs.values()]
+            avgdl = sum(lengths) / len(lengths)
+        vectors = create_category_vectors(index, category_vocabs, weight, idf, avgdl)
+        categories = list(vectors)
+        matrix = TermMatrix.from_vectors([vectors[cat] for cat in categories], len(dimensions))
+        model = cls(dimensions, categories, matrix, weight, idf, avgdl, options)
+        model.vectors = vectors
+        return model
+
+    @classmethod
+    def load(cls, filename):
+        """Load a model from a file written by save(), returns None if there is no
+        such file or if the file was written for another version of the model."""
+        result = read_arrays(filename)
+        if result is None:
+            return None
+        meta, arrays = result
+        if meta.get('version') != MODEL_VERSION:
+            return None
+        dimensions = meta['dimensions']
+        if isinstance(dimensions, dict):
+            dimensions = HashedDimensions(dimensions['buckets'])
+        matrix = TermMatrix(len(meta['categories']), arrays['starts'],
+                            arrays['categories'], arrays['weights'])
+        return cls(dimensions, meta['categories'], matrix, meta['weight'], arrays.get('idf'),
+                   meta['avgdl'], meta['options'])
+
+    def save(self, filename):
+        dimensions = self.dimensions
+        if isinstance(dimensions, HashedDimensions):
+            dimensions = {'buckets': dimensions.buckets}
+        meta = {'version': MODEL_VERSION, 'weight': self.weight, 'avgdl': self.avgdl,
+                'options': self.options, 'categories': self.categories,
+                'dimensions': dimensions}
+        arrays = {'starts': array('I', self.matrix.starts),
+                  'categories': array('H', self.matrix.categories),
+                  'weights': array('d', self.matrix.weights)}
+        if self.idf is not None:
+            arrays['idf'] = array('d', self.idf)
+        write_arrays(filename, meta, arrays)
 
-    # Get the vocabularies for the text and the Brown categories and calculate
-    # the dimensions from the category vocabularies. This uses a global variable
-    # so we only need to calculate the vocabularies once.
+    def __str__(self):
+        return "<CategoryModel categories=%d dimensions=%d weight=%s>" \
+            % (len(self.categories), len(self.dimensions), self.weight)
+
+    def vector(self, text):
+        """Return the vector for a text, which is either a Vocabulary or something
+        a Vocabulary can be created from."""
+        vocab = text if isinstance(text, Vocabulary) else Vocabulary(text)
+        return Vector(self.index, vocab, self.weight, self.idf, self.avgdl)
+
+    def similarities(self, texts):
+        """Return the similarity matrix for a list of texts, with a row for each
+        text and a column for each category, in the order of self.categories. This
+        multiplies the text by term matrix with the normalized term by category
+        matrix, one text at a time, and divides each row by the magnitude of the
+        text vector."""
+        matrix = []
+        for text in texts:
+            vector = self.vector(text)
+            row = self.matrix.products(vector.data)
+            if vector.magnitude:
+                row = [score / vector.magnitude for score in row]
+            matrix.append(row)
+        return matrix
+
+
+class TermMatrix(object):
+
+    """A sparse term by category matrix, stored by term: the non-zero entries for
+    the term at dimension position t are at positions starts[t] up to starts[t+1]
+    of the categories array, with the category positions, and of the weights
+    array. Multiplying a sparse vector with the matrix only looks at the entries
+    for the non-zero terms of the vector."""
+
+    def __init__(self, size, starts, categories, weights):
+        self.size = size
+        self.starts = starts
+        self.categories = categories
+        self.weights = weights
+
+    @classmethod
+    def from_vectors(cls, vectors, length):
+        """Create the matrix from a list of vectors with the given number of
+        dimensions, each vector is normalized and becomes a column."""
+        entries = sorted((i, c, weight / vector.magnitude)
+                         for c, vector in enumerate(vectors) if vector.magnitude
+                         for i, weight in vector.data.items())
+        counts = Counter(i for i, c, weight in entries)
+        starts = array('I', accumulate(map(counts.__getitem__, range(length)), initial=0))
+        return cls(len(vectors), starts,
+                   array('H', [c for i, c, weight in entries]),
+                   array('d', [weight for i, c, weight in entries]))
+
+    def __str__(self):
+        return "<TermMatrix terms=%d categories=%d entries=%d>" \
+            % (len(self.starts) - 1, self.size, len(self.weights))
+
+    def products(self, data):
+        """Return the dot products of a sparse vector, given as a dictionary from
+        dimension positions to weights, with each of the columns."""
+        scores = [0.0] * self.size
+        starts, categories, weights = self.starts, self.categories, self.weights
+        for i, value in data.items():
+            start, end = starts[i], starts[i + 1]
+            for c, weight in zip(categories[start:end], weights[start:end]):
+                scores[c] += value * weight
+        return scores
+
+def dot(data1, data2):
+    """Dot product of two sparse vectors given as dictionaries."""
+    small, large = sorted((data1, data2), key=len)
+    return sum(map(mul, small.values(), map(large.get, small.keys(), repeat(0))))
+
+def get_brown_model(weight='frequency', **options):
+    """Return the CategoryModel for the Brown categories, the options are handed to
+    get_dimensions(). The model is loaded from the compiled model file for the
+    weight and options if it was compiled for the current categories, otherwise
+    it is compiled and saved. Either way this happens only once for each weight
+    and set of options."""
+    key = model_name(weight, options)
+    if key not in BROWN_MODELS:
+        model = CategoryModel.load(COMPILED_BROWN_MODEL % key)
+        if (model is None or model.categories != list(BROWN_CATEGORIES)
+                or model.options != options):
+            model = compile_brown_model(weight, **options)
+        BROWN_MODELS[key] = model
+    return BROWN_MODELS[key]
+
+def compile_brown_model(weight='frequency', filename=None, **options):
+    """Create the CategoryModel for the Brown categories from the corpus and save it
+    to a file, the default is COMPILED_BROWN_MODEL for the weight and options."""
     global BROWN_VOCABULARIES
-    vocab = Vocabulary(text)
     if BROWN_VOCABULARIES is None:
         BROWN_VOCABULARIES = get_category_vocabs(BROWN_CATEGORIES)
-    dimensions = get_dimensions(BROWN_VOCABULARIES)
+    model = CategoryModel.from_vocabularies(BROWN_VOCABULARIES, weight, **options)
+    model.save(filename or COMPILED_BROWN_MODEL % model_name(weight, options))
+    return model
+
+def model_name(weight, options):
+    """Return a name for a model like 'tfidf' or 'tfidf-min_df=2-top_k=5000'."""
+    return '-'.join([weight] + ["%s=%s" % (k, v) for k, v in sorted(options.items())])
+
+def similarity_matrix(texts, model=None, weight='frequency'):
+    """Compare many texts to many categories at once. Takes a list of texts (or
+    vocabularies) and returns a list of rows with cosine scores, one row for each
+    text and one column for each category of the model. The default model has the
+    five categories from Brown."""
+    if model is None:
+        model = get_brown_model(weight)
+    return model.similarities(texts)
 
-    # Get the vectors for all texts and categories
-    weight = 'frequency'
-    text_vector = Vector(dimensions, vocab, weight)
-    category_vectors = create_category_vectors(dimensions, BROWN_VOCABULARIES, weight)
 
-    # print the similarities for the text relative to all categories
-    for cat in category_vectors:
-        catvec = category_vectors[cat]
-        cosine = text_vector.cosine(catvec)
+def compare_to_brown(text, weight='frequency', model=None):
+    """Compare the text to the five categories from Brown and print the similarity
+    scores using the cosine measure. The scores are also returned as a dictionary
+    indexed on category. Like with similarity_matrix() another model can be
+    used instead of the one for the Brown categories."""
+    if model is None:
+        model = get_brown_model(weight)
+    scores = model.similarities([text])[0]
+    for cat, cosine in zip(model.categories, scores):
         print("   %-12s %.2f" % (cat, cosine))
+    return dict(zip(model.categories, scores))
+
+
+if __name__ == '__main__':
+
+    if sys.argv[1:2] == ['--compile-brown']:
+        for weight in sys.argv[2:] or ['frequency']:
+            print(compile_brown_model(weight))
+            print("Saved in %s" % (COMPILED_BROWN_MODEL % weight))
@@ -4,22 +4,24 @@
 """
 
 import re
-import os
 import math
 
 import nltk
 from nltk.corpus import brown
 from nltk.corpus import wordnet as wn
-from nltk.corpus import PlaintextCorpusReader
 
-from fsa import FSA
+from fsa import CompiledFSA, MultiFSA, Match
+from reader import read_raw, read_chunks, TokenStream
+from cache import load_tokens, tokenize, load_artifact, store_artifact
+from concordance import PositionalIndex
+from alignment import Alignment
+from search import compile_pattern, PatternSet
+from textstats import TextStatistics
 
+# NLTK stoplist with 3136 words (multilingual) and vocabulary with 234,377
+# English words from NLTK, both are loaded on first use
+from resources import STOPLIST, ENGLISH_VOCABULARY
 
-# NLTK stoplist with 3136 words (multilingual)
-STOPLIST = set(nltk.corpus.stopwords.words())
-
-# Vocabulary with 234,377 English words from NLTK
-ENGLISH_VOCABULARY = set(w.lower() for w in nltk.corpus.words.words())
 
 # The five categories from Brown that we are using
 BROWN_CATEGORIES = ('adventure', 'fiction', 'government', 'humor', 'news')
@@ -27,6 +29,14 @@ BROWN_CATEGORIES = ('adventure', 'fiction', 'government', 'humor', 'news')
 # Global place to store Brown vocabularies so you calculate them only once
 BROWN_VOCABULARIES = None
 
+# Patterns for the find methods on Text, searched for together
+FIND_PATTERNS = PatternSet({
+    'sirs': r"\bSir \S+\b",
+    # use a non-greedy match on the characters between the brackets
+    'brackets': r"([\(\[\{]).+?([\)\]\}])",
+    'roles': (r"^([A-Z]{2,}[^\:]+): ", re.MULTILINE),
+    'repeated_words': r"(\w{3,}) \1 \1"})
+
 
 def is_content_word(word):
     """A content word is not on the stoplist and its first character is a letter."""
@@ -35,77 +45,176 @@ def is_content_word(word):
 
 class Text(object):
     
-    def __init__(self, path, name=None):
+    def __init__(self, path, name=None, stream=False, cache=True):
         """Takes a file path, which is assumed to point to a file or a directory, 
-        extracts and stores the raw text and also stores an instance of nltk.text.Text."""
+        extracts and stores the raw text and also stores an instance of nltk.text.Text.
+        With stream=True nothing is read yet and the text is a TokenStream that
+        reads and tokenizes the source in chunks whenever it is iterated over,
+        there is no raw text then and methods that need it will not work.
+        Unless cache=False, tokens come from the tokenization cache if possible
+        (and are added to it if the text is not streamed), in which case they
+        are also available as a TokenArrays instance in self.tokens."""
         self.name = name
-        if os.path.isfile(path):
-            self.raw = open(path).read()
-        elif os.path.isdir(path):
-            corpus = PlaintextCorpusReader(path, '.*.mrg')
-            self.raw = corpus.raw()
-        self.text = nltk.text.Text( nltk.word_tokenize(self.raw))
+        self.path = path
+        self.stream = stream
+        self.statistics = None
+        self.tokens = None
+        self.positions = None
+        self.alignment = None
+        self.extractions = None
+        if stream:
+            self.raw = None
+            if cache:
+                self.tokens = load_tokens(path)
+            self.text = TokenStream(path) if self.tokens is None else self.tokens
+        else:
+            self.raw = read_raw(path)
+            if self.raw is None:
+                raise FileNotFoundError("no such file or directory: %s" % path)
+            if cache:
+                self.tokens = tokenize(path)
+                self.text = nltk.text.Text(self.tokens)
+            else:
+                self.text = nltk.text.Text( nltk.word_tokenize(self.raw))
 
     def __len__(self):
+        if self.stream:
+            return self.stats().tokens
         return len(self.text)
 
     def __getitem__(self, i):
+        if isinstance(self.text, TokenStream):
+            raise TypeError("a streamed text without cached tokens cannot be indexed,"
+                            " use token_list() or iterate over it")
         return self.text[i]
 
+    def __iter__(self):
+        return iter(self.text)
+
     def __str__(self):
         name = '' if self.name is None else " '%s'" % self.name 
         return "<Text%s tokens=%s>" % (name, len(self))
 
+    # The statistics methods are all served from one TextStatistics instance,
+    # which is created on first use with one pass over the tokens.
+
+    def stats(self):
+        """Return the statistics for the text, calculating them only once."""
+        if self.statistics is None:
+            self.statistics = TextStatistics(self.text, is_content_word)
+        return self.statistics
+
     def token_count(self):
         """Just return the length of the text."""
         return len(self)
 
     def type_count(self):
         """Returns the type count, with minimal normalization by lower casing."""
-        # an alternative would be to use the method nltk.text.Text.vocab()
-        return len(set([w.lower() for w in self.text]))
+        return self.stats().types
 
     def sentence_count(self):
         """Return number of sentences, using the simplistic measure of counting period,
         exclamation marks and question marks."""
         # could also use nltk.sent.tokenize on self.raw
-        return len([t for t in self.text if t in '.!?'])
+        return self.stats().sentences
 
     def most_frequent_content_words(self):
         """Return a list with the 25 most frequent content words and their
         frequencies. The list has (word, frequency) pairs and is ordered
         on the frequency."""
-        dist = nltk.FreqDist([w for w in self.text if is_content_word(w.lower())])
-        return dist.most_common(n=25)
+        return self.stats().most_frequent_content_words(n=25)
 
     def most_frequent_bigrams(self, n=25):
         """Return a list with the 25 most frequent bigrams that only contain
         content words. The list returned should have pairs where the first
         element in the pair is the bigram and the second the frequency, as in
         ((word1, word2), frequency), these should be ordered on frequency."""
-        filtered_bigrams = [b for b in list(nltk.bigrams(self.text))
-                            if is_content_word(b[0]) and is_content_word(b[1])]
-        dist = nltk.FreqDist([b for b in filtered_bigrams])
-        return dist.most_common(n=n)
-
-    def concordance(self, word):
-        self.text.concordance(word)
+        return self.stats().most_frequent_bigrams(n=n)
+
+    def index(self):
+        """Return the positional index for the text. It is created on first use and,
+        if the tokens come from the tokenization cache, saved in the cache too so
+        the next time it can be loaded from there."""
+        if self.positions is None:
+            if self.tokens is None:
+                self.positions = PositionalIndex.from_tokens(list(self.text))
+            else:
+                cached = load_artifact(self.path, 'index')
+                if cached is not None:
+                    self.positions = PositionalIndex.from_arrays(self.tokens, *cached)
+                else:
+                    self.positions = PositionalIndex.from_tokens(self.tokens)
+                    store_artifact(self.path, 'index', *self.positions.to_arrays())
+        return self.positions
+
+    def concordance(self, word, width=79, lines=25):
+        """Print a concordance for the word."""
+        self.index().print_kwic(word, width, lines)
+
+    def kwic(self, word, width=79, offset=0, limit=25):
+        """Return a list of concordance lines for the word, see PositionalIndex.kwic()
+        for the arguments. Lines are instances of nltk.text.ConcordanceLine."""
+        return self.index().kwic(word, width, offset, limit)
+
+    def align(self):
+        """Return the alignment of the tokens with the raw text, see alignment.py.
+        It is created on first use and cached like the positional index."""
+        if self.alignment is None:
+            cached = None if self.tokens is None else load_artifact(self.path, 'alignment')
+            if cached is not None:
+                self.alignment = Alignment.from_arrays(*cached)
+            else:
+                raw = read_raw(self.path) if self.raw is None else self.raw
+                self.alignment = Alignment.from_tokens(self.text, raw)
+                if self.tokens is not None:
+                    store_artifact(self.path, 'alignment', *self.alignment.to_arrays())
+        return self.alignment
+
+    def match_tokens(self, match):
+        """Return the first and last token (the latter not included) that overlap
+        with a match on the raw text, as returned by search()."""
+        return self.align().token_span(match.start(), match.end())
+
+    def raw_span(self, first, last):
+        """Return the start and end offsets in the raw text of the tokens from first
+        up to but not including last, for example of a match from apply_fsa()."""
+        return self.align().char_span(first, last)
 
     ## new methods for search part of assignment 3
-    
-    def search(self, pattern):
-        return re.finditer(pattern, self.raw)
+
+    def search(self, pattern, flags=0):
+        return compile_pattern(pattern, flags).finditer(self.raw)
+
+    def search_all(self, patterns):
+        """Search for a set of named patterns in the raw text. Takes a dictionary of
+        patterns (see PatternSet) and returns a dictionary with for each pattern
+        name a list of matches. For a streamed text the source is searched chunk
+        by chunk, see PatternSet.scan_chunks() if you also need the offsets of
+        those matches."""
+        pattern_set = patterns if isinstance(patterns, PatternSet) else PatternSet(patterns)
+        if not self.stream:
+            return pattern_set.search(self.raw)
+        results = {name: [] for name in pattern_set.names}
+        for name, offset, match in pattern_set.scan_chunks(read_chunks(self.path)):
+            results[name].append(match)
+        return results
+
+    def extract(self):
+        """Return the matches for all the patterns used by the find methods below,
+        which are all searched for only once."""
+        if self.extractions is None:
+            self.extractions = self.search_all(FIND_PATTERNS)
+        return self.extractions
 
     def find_sirs(self):
         answer = set()
-        for match in self.search(r"\bSir \S+\b"):
+        for match in self.extract()['sirs']:
             answer.add(match.group())
         return sorted(answer)
 
     def find_brackets(self):
         answer = set()
-        # use a non-greedy match on the characters between the brackets
-        for match in self.search(r"([\(\[\{]).+?([\)\]\}])"):
+        for match in self.extract()['brackets']:
             brackets = "%s%s" % (match.group(1), match.group(2))
             # this tests for matching pairs
             if brackets in ['[]', '{}', '()']:
@@ -114,28 +223,54 @@ class Text(object):
 
     def find_roles(self):
         answer = set()
-        for match in re.finditer(r"^([A-Z]{2,}[^\:]+): ", self.raw, re.MULTILINE):
+        for match in self.extract()['roles']:
             answer.add(match.group(1))
         return sorted(answer)
 
     def find_repeated_words(self):
         answer = set()
-        for match in self.search(r"(\w{3,}) \1 \1"):
+        for match in self.extract()['repeated_words']:
             answer.add(match.group())
         return sorted(answer)
 
     def apply_fsa(self, fsa):
+        """Return a list of (offset, match) pairs for the longest non-overlapping
+        matches of the FSA, walking the tokens by offset without copying them. The
+        FSA can also be a CompiledFSA, in which case the tokens are interned first
+        and the scan runs on the symbol ids."""
+        if isinstance(fsa, CompiledFSA):
+            tokens = self.token_list() if self.tokens is None else self.tokens
+            return [(start, Match(tokens, start, end))
+                    for start, end in fsa.scan(fsa.intern(tokens))]
+        tokens = self.token_list()
         i = 0
         results = []
-        while i < len(self):
-            match = fsa.consume(self.text[i:])
-            if match:
-                results.append((i, match))
-                i += len(match)
+        while i < len(tokens):
+            end = fsa.longest_match(tokens, i)
+            if end is not None:
+                results.append((i, Match(tokens, i, end)))
+                i = end
             else:
                 i += 1
         return results
 
+    def apply_fsas(self, fsas):
+        """Apply a list of FSAs, or a MultiFSA, in one scan over the tokens. Returns a
+        dictionary indexed on FSA names with for each FSA the list of (offset,
+        match) pairs that apply_fsa() would return for it."""
+        multi_fsa = fsas if isinstance(fsas, MultiFSA) else MultiFSA(fsas)
+        tokens = self.token_list()
+        results = {name: [] for name in multi_fsa.names}
+        for name, start, end in multi_fsa.scan(tokens):
+            results[name].append((start, Match(tokens, start, end)))
+        return results
+
+    def token_list(self):
+        """Return the tokens as a list, for a streamed text this reads all tokens."""
+        if isinstance(self.text, nltk.text.Text):
+            return self.text.tokens
+        return list(self.text)
+
 
 class Vocabulary():
 
@@ -148,13 +283,14 @@ class Vocabulary():
     lower case."""
 
     def __init__(self, text):
+        self.source = text
         self.text = text.text
         # keeping the unfiltered list around for statistics
         self.all_items = set([w.lower() for w in text])
         self.items = self.all_items.intersection(ENGLISH_VOCABULARY)
         # restricting the frequency dictionary to vocabulary items
         self.fdist = nltk.FreqDist(t.lower() for t in text if t.lower() in self.items)
-        self.text_size = len(self.text)
+        self.text_size = len(text)
         self.vocab_size = len(self.items)
 
     def __str__(self):
@@ -185,7 +321,7 @@ class Vocabulary():
         return synsets[0].definition() if synsets else 'NO DEFINITION'
 
     def kwic(self, word):
-        self.text.concordance(word)
+        self.source.concordance(word)
         
 
 
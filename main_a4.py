@@ -1,5 +1,84 @@
+"""main_a4.py
 
+Text with part-of-speech tags. The Text here is the Text from assignment 3 with
+tags added and with methods for the questions that brown.py answers for the
+Brown corpus. Tagging is done only once, the first time tags are needed, and
+after that the tags are kept as an array of tag ids next to the tokens. If the
+tokens come from the tokenization cache then the tags are cached too, see
+tagging.py.
 
-class Text(object):
+Run this script with --tagger-train, --tagger-run, --tagger-test or --serve to
+train and use the tagger in postag.py.
 
-    pass
+"""
+
+import sys
+
+import main_a3
+import brown
+import postag
+from tagstats import TaggedSequence
+from tagging import tag_sentences, load_tags, store_tags
+from cache import TokenArrays, stream_sentences
+
+
+class Text(main_a3.Text, TaggedSequence):
+
+    def __init__(self, path, name=None, stream=False, cache=True, workers=None):
+        """See main_a3.Text for the arguments, workers is the maximum number of
+        processes used for tagging (the default is the number of CPUs)."""
+        main_a3.Text.__init__(self, path, name=name, stream=stream, cache=cache)
+        self.workers = workers
+        self.tag_statistics = None
+        self.tagging = None
+
+    def sentence_tokens(self):
+        """Return the tokens as a TokenArrays instance, which knows where sentences
+        end. Without a tokenization cache they are read from the same sentence
+        stream that the cache is made from, so tags do not depend on the cache."""
+        if self.tokens is not None:
+            return self.tokens
+        return TokenArrays.from_sentences(stream_sentences(self.path))
+
+    def sentences(self):
+        """Generate the sentences of the text as lists of tokens."""
+        return self.sentence_tokens().sentences()
+
+    def tag_arrays(self):
+        """Return the words, tags, word ids and tag ids of the text, tagging the
+        text the first time this is called. The words and word ids are the types
+        and type ids of sentence_tokens()."""
+        if self.tagging is None:
+            tokens = self.sentence_tokens()
+            cached = None if self.tokens is None else load_tags(self.path)
+            if cached is not None:
+                tags, tag_ids = cached
+            else:
+                tags, tag_ids = tag_sentences(tokens.sentences(), workers=self.workers)
+                if self.tokens is not None:
+                    store_tags(self.path, tags, tag_ids)
+            self.tagging = (tokens.types, tags, tokens.ids, tag_ids)
+        return self.tagging
+
+    def nouns_more_common_in_plural_form(self):
+        return brown.nouns_more_common_in_plural_form(self)
+
+    def which_word_has_greatest_number_of_distinct_tags(self):
+        return brown.which_word_has_greatest_number_of_distinct_tags(self)
+
+    def tags_in_order_of_decreasing_frequency(self):
+        return brown.tags_in_order_of_decreasing_frequency(self)
+
+    def tags_that_nouns_are_most_commonly_found_after(self):
+        return brown.tags_that_nouns_are_most_commonly_found_after(self)
+
+    def proportion_ambiguous_word_types(self):
+        return brown.proportion_ambiguous_word_types(self)
+
+    def proportion_ambiguous_word_tokens(self):
+        return brown.proportion_ambiguous_word_tokens(self)
+
+
+if __name__ == '__main__':
+
+    postag.main(sys.argv[1:])
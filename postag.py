@@ -1 +1,402 @@
+"""postag.py
 
+Part-of-speech tagger trained on the news category of the Brown corpus.
+
+The tagger is a trigram tagger that backs off to a bigram tagger, a unigram
+tagger and finally to a default tagger. It is trained with the NLTK taggers,
+but instead of pickling those it is exported to MODEL_FILE, an array file as
+written by cache.write_arrays(). The words and tags are interned and each of
+the n-gram taggers is stored as a sorted array of integer keys, one for each
+context, and an array with the tag for each context. Loading the model
+memory-maps the file, so it is fast and the arrays are never copied. Tagging
+looks up the key for a context with a binary search.
+
+Usage:
+
+$ python main_a4.py --tagger-train
+$ python main_a4.py --tagger-run "some sentence to be tagged"
+$ python main_a4.py --tagger-test news
+$ python main_a4.py --tagger-test reviews [--workers N] [--top N]
+$ python main_a4.py --serve [PORT]
+
+Testing streams the test sentences in shards to a pool of worker processes,
+each of which loads the model once. Every shard comes back as a confusion
+matrix, a Counter of (gold tag, predicted tag) pairs, and the accuracy and the
+precision and recall of each tag are calculated from the sum of those. The
+report also has the number of tokens tagged per second and the peak memory use
+of the main process and of the workers.
+
+Serving keeps the model loaded and tags each line from the standard input or,
+if a port is given, each line sent to that port on localhost.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import socketserver
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import nltk
+from nltk.corpus import brown
+
+from cache import write_arrays, read_arrays
+from tagging import batches
+
+
+# Relative path of the exported model
+MODEL_FILE = 'postag.model'
+
+# Bump this when the model format changes, older models can then not be loaded
+MODEL_VERSION = 1
+
+# Tag for words that none of the n-gram taggers knows about
+DEFAULT_TAG = 'NN'
+
+# Numbers of previous tags used by the n-gram taggers, in backoff order
+HISTORIES = (2, 1, 0)
+
+# Part of the news category used for training, the rest is used for testing
+TRAIN_FRACTION = 0.9
+
+# Number of test sentences sent to a worker process at a time
+SHARD_SIZE = 1000
+
+# Number of shards per worker that are waiting or being tagged at any time, this
+# bounds how much of the corpus is in memory
+SHARDS_PER_WORKER = 2
+
+# Models loaded in this process, indexed on file name
+MODEL_INSTANCES = {}
+
+
+def train_sentences(category='news'):
+    sentences = brown.tagged_sents(categories=category)
+    return sentences[:int(len(sentences) * TRAIN_FRACTION)]
+
+
+def test_sentences(category):
+    """Return the held out part of the news category or all of any other category."""
+    sentences = brown.tagged_sents(categories=category)
+    if category == 'news':
+        return sentences[int(len(sentences) * TRAIN_FRACTION):]
+    return sentences
+
+
+def train(sentences=None, filename=MODEL_FILE):
+    """Train the backoff tagger on the news sentences and export it. Returns the
+    exported model."""
+    if sentences is None:
+        sentences = train_sentences()
+    sentences = list(sentences)
+    tagger = nltk.DefaultTagger(DEFAULT_TAG)
+    taggers = {}
+    for history in reversed(HISTORIES):
+        if history == 0:
+            tagger = nltk.UnigramTagger(sentences, backoff=tagger)
+        else:
+            tagger = nltk.NgramTagger(history + 1, sentences, backoff=tagger)
+        taggers[history] = tagger
+    meta, arrays = export_taggers(taggers, sentences)
+    write_arrays(filename, meta, arrays)
+    return TaggerModel(meta, arrays)
+
+
+def export_taggers(taggers, sentences):
+    """Return the meta data and arrays for a dictionary of NLTK context taggers
+    indexed on the number of previous tags they use."""
+    word_index = {}
+    tag_index = {DEFAULT_TAG: 0}
+    for sentence in sentences:
+        for word, tag in sentence:
+            word_index.setdefault(word, len(word_index))
+            tag_index.setdefault(tag, len(tag_index))
+    arrays = {}
+    for history, tagger in taggers.items():
+        table = {}
+        # _context_to_tag is the only way to get at what an NLTK tagger learned
+        for context, tag in tagger._context_to_tag.items():
+            if history == 0:
+                previous, word = (), context
+            else:
+                previous, word = context
+            key = context_key(tuple(map(tag_index.__getitem__, previous)),
+                              word_index[word], history, len(tag_index), len(word_index))
+            table[key] = tag_index[tag]
+        keys = sorted(table)
+        arrays['keys%d' % history] = array('Q', keys)
+        arrays['tags%d' % history] = array('H', map(table.__getitem__, keys))
+    meta = {'version': MODEL_VERSION, 'nltk': nltk.__version__,
+            'histories': [h for h in HISTORIES if h in taggers],
+            'words': list(word_index), 'tags': list(tag_index)}
+    return meta, arrays
+
+
+def context_key(previous, word_id, history, tag_count, word_count):
+    """Return the integer key for a word and its previous tags. Missing tags at the
+    start of a sentence get the id tag_count."""
+    key = 0
+    previous = (tag_count,) * (history - len(previous)) + previous
+    for tag_id in previous:
+        key = key * (tag_count + 1) + tag_id
+    return key * word_count + word_id
+
+
+class TaggerModel(object):
+
+    """A tagger exported by train(), tagging uses the same backoff as the NLTK
+    taggers it was exported from and gives the same tags."""
+
+    def __init__(self, meta, arrays):
+        self.words = meta['words']
+        self.tags = meta['tags']
+        self.histories = meta['histories']
+        self.word_index = {word: i for i, word in enumerate(self.words)}
+        self.tables = [(history, arrays['keys%d' % history], arrays['tags%d' % history])
+                       for history in self.histories]
+
+    @classmethod
+    def load(cls, filename=MODEL_FILE):
+        """Load the model, returns None if there is no model or if it was exported by
+        another version."""
+        result = read_arrays(filename)
+        if result is None or result[0].get('version') != MODEL_VERSION:
+            return None
+        return cls(*result)
+
+    def __str__(self):
+        return "<TaggerModel words=%d tags=%d contexts=%d>" \
+            % (len(self.words), len(self.tags), sum(len(t[1]) for t in self.tables))
+
+    def tag_ids(self, tokens):
+        """Return a list with a tag id for each token."""
+        tag_count = len(self.tags)
+        word_count = len(self.words)
+        tag_ids = []
+        for token in tokens:
+            tag_id = 0
+            word_id = self.word_index.get(token)
+            if word_id is not None:
+                for history, keys, tags in self.tables:
+                    previous = tuple(tag_ids[max(0, len(tag_ids) - history):]) if history else ()
+                    key = context_key(previous, word_id, history, tag_count, word_count)
+                    i = bisect_left(keys, key)
+                    if i < len(keys) and keys[i] == key:
+                        tag_id = tags[i]
+                        break
+            tag_ids.append(tag_id)
+        return tag_ids
+
+    def tag(self, tokens):
+        """Return a list of (token, tag) pairs."""
+        return list(zip(tokens, map(self.tags.__getitem__, self.tag_ids(tokens))))
+
+    def tag_sents(self, sentences):
+        return [self.tag(sentence) for sentence in sentences]
+
+
+def load_model(filename=MODEL_FILE):
+    model = TaggerModel.load(filename)
+    if model is None:
+        sys.exit("No tagger model in %s, train one with --tagger-train" % filename)
+    return model
+
+
+def run(sentence, model=None):
+    """Tag a sentence and print the result."""
+    model = load_model() if model is None else model
+    print(' '.join("%s/%s" % pair for pair in model.tag(nltk.word_tokenize(sentence))))
+
+
+def get_model(filename=MODEL_FILE):
+    """Return the model in the file, loading it only once in each process."""
+    if filename not in MODEL_INSTANCES:
+        MODEL_INSTANCES[filename] = load_model(filename)
+    return MODEL_INSTANCES[filename]
+
+
+def evaluate_shard(sentences, filename=MODEL_FILE):
+    """Tag a list of tagged sentences and return the confusion matrix as a Counter
+    of (gold tag, predicted tag) pairs. The model is loaded once in each worker
+    process and only the sentences and the counts are sent between processes."""
+    model = get_model(filename)
+    confusion = Counter()
+    for sentence in sentences:
+        gold = [tag for word, tag in sentence]
+        predicted = model.tag_ids([word for word, tag in sentence])
+        confusion.update(zip(gold, map(model.tags.__getitem__, predicted)))
+    return confusion
+
+
+def evaluate_sentences(sentences, filename=MODEL_FILE, workers=None, shard_size=SHARD_SIZE):
+    """Evaluate the model on a sequence of tagged sentences and return an
+    Evaluation. Shards of sentences are tagged in at most the given number of
+    worker processes (the default is the number of CPUs), with one worker no
+    processes are started. The sentences are read as they are needed, so a
+    corpus view is never read into memory as a whole."""
+    load_model(filename)
+    start = time.perf_counter()
+    confusion = Counter()
+    shards = batches(sentences, shard_size)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for shard in shards:
+            confusion.update(evaluate_shard(shard, filename))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            limit = SHARDS_PER_WORKER * workers
+            for shard in shards:
+                pending.append(executor.submit(evaluate_shard, shard, filename))
+                if len(pending) >= limit:
+                    confusion.update(pending.popleft().result())
+            while pending:
+                confusion.update(pending.popleft().result())
+    return Evaluation(confusion, time.perf_counter() - start, workers)
+
+
+def evaluate(category, filename=MODEL_FILE, workers=None):
+    """Return the Evaluation of the model on the test sentences of the category."""
+    return evaluate_sentences(test_sentences(category), filename, workers)
+
+
+def peak_memory():
+    """Return the peak resident memory in MB of this process and of its finished
+    child processes, the latter is the largest of any one child. Returns None for
+    both where the resource module does not exist, which is on Windows."""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+
+class Evaluation(object):
+
+    """The result of tagging a test set, with the confusion matrix as a Counter of
+    (gold tag, predicted tag) pairs, the time it took in seconds and the number
+    of worker processes used."""
+
+    def __init__(self, confusion, seconds, workers=1):
+        self.confusion = confusion
+        self.seconds = seconds
+        self.workers = workers
+        self.gold_counts = Counter()
+        self.predicted_counts = Counter()
+        self.correct = Counter()
+        for (gold, predicted), count in confusion.items():
+            self.gold_counts[gold] += count
+            self.predicted_counts[predicted] += count
+            if gold == predicted:
+                self.correct[gold] += count
+        self.tokens = sum(self.gold_counts.values())
+
+    def __str__(self):
+        return "<Evaluation tokens=%d accuracy=%.4f>" % (self.tokens, self.accuracy())
+
+    def accuracy(self):
+        return sum(self.correct.values()) / self.tokens if self.tokens else 0.0
+
+    def precision(self, tag):
+        predicted = self.predicted_counts[tag]
+        return self.correct[tag] / predicted if predicted else 0.0
+
+    def recall(self, tag):
+        gold = self.gold_counts[tag]
+        return self.correct[tag] / gold if gold else 0.0
+
+    def confusions(self):
+        """Return the ((gold, predicted), count) pairs of the errors, most frequent
+        first."""
+        return [(pair, count) for pair, count in self.confusion.most_common()
+                if pair[0] != pair[1]]
+
+    def tokens_per_second(self):
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    def report(self, top=20):
+        """Print the accuracy, the precision and recall of the top most frequent
+        tags, the top most frequent confusions, and the speed and memory use."""
+        print("Accuracy: %.4f (%d tokens)" % (self.accuracy(), self.tokens))
+        print("\n%-8s %8s %9s %9s" % ('tag', 'gold', 'precision', 'recall'))
+        for tag, count in self.gold_counts.most_common(top):
+            print("%-8s %8d %9.4f %9.4f" % (tag, count, self.precision(tag), self.recall(tag)))
+        print("\n%-8s %-8s %8s" % ('gold', 'tagged', 'count'))
+        for (gold, predicted), count in self.confusions()[:top]:
+            print("%-8s %-8s %8d" % (gold, predicted, count))
+        print("\nTagged %d tokens in %.2f seconds (%d tokens/sec)"
+              % (self.tokens, self.seconds, self.tokens_per_second()))
+        main_memory, worker_memory = peak_memory()
+        if main_memory is None:
+            print("Peak memory: not available on this platform")
+        elif self.workers == 1:
+            print("Peak memory: %.1f MB" % main_memory)
+        else:
+            print("Peak memory: %.1f MB in the main process, %.1f MB in a worker (%d workers)"
+                  % (main_memory, worker_memory, self.workers))
+
+
+def serve(port=None, model=None):
+    """Tag lines from the standard input, or from connections to the port on
+    localhost, until the input ends or the server is interrupted."""
+    model = load_model() if model is None else model
+    if port is None:
+        for line in sys.stdin:
+            run(line, model)
+            sys.stdout.flush()
+        return
+
+    class TagHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                tagged = model.tag(nltk.word_tokenize(line.decode('utf-8')))
+                answer = ' '.join("%s/%s" % pair for pair in tagged)
+                self.wfile.write(("%s\n" % answer).encode('utf-8'))
+
+    class TaggerServer(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    with TaggerServer(('localhost', port), TagHandler) as server:
+        print("Serving %s on localhost:%d" % (model, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Train, run and test the tagger.")
+    parser.add_argument('--tagger-train', action='store_true', help="train and export the model")
+    parser.add_argument('--tagger-run', metavar='SENTENCE', help="tag a sentence")
+    parser.add_argument('--tagger-test', choices=('news', 'reviews'),
+                        help="evaluate on a Brown category")
+    parser.add_argument('--workers', type=int,
+                        help="number of processes used for testing (default: number of CPUs)")
+    parser.add_argument('--top', type=int, default=20,
+                        help="number of tags and confusions shown when testing")
+    parser.add_argument('--serve', metavar='PORT', nargs='?', type=int, const=0,
+                        help="tag lines from stdin, or from a port on localhost")
+    args = parser.parse_args(args)
+    if args.tagger_train:
+        model = train()
+        print("Saved %s in %s" % (model, MODEL_FILE))
+    if args.tagger_run is not None:
+        run(args.tagger_run)
+    if args.tagger_test is not None:
+        print("Testing on %s" % args.tagger_test)
+        evaluate(args.tagger_test, workers=args.workers).report(args.top)
+    if args.serve is not None:
+        serve(args.serve or None)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,148 @@
+"""reader.py
+
+Separate module to store code for reading source data, where the source is a
+file or a directory with .mrg files.
+
+Besides reading all the data in one go you can also stream it. Streaming reads
+the data in chunks that end at a sentence boundary found by nltk.sent_tokenize()
+on the text read so far. A boundary is only used if at least one more sentence
+follows it in that text, because the sentence tokenizer looks at the word after
+a period to decide whether there is a boundary. Since the word tokenizer first
+splits a text into sentences and then tokenizes each sentence, tokenizing the
+chunks one by one gives the same tokens as tokenizing all of the data at once,
+without ever having the whole text in memory. A chunk can be much longer than
+the chunk size if there are no sentence boundaries in the text.
+
+"""
+
+import os
+
+import nltk
+from nltk.corpus import PlaintextCorpusReader
+
+
+# Chunk size in characters, chunks will be a bit longer or shorter because we
+# cut them at a sentence boundary
+CHUNK_SIZE = 2 ** 20
+
+
+def corpus_reader(path):
+    """Return a corpus reader for all files with the mrg extension in the
+    directory, avoiding hidden files like .DS_Store that can cause trouble."""
+    return PlaintextCorpusReader(path, '.*.mrg')
+
+
+def read_raw(path):
+    """Takes a file path, which is assumed to point to a file or a directory,
+    and returns the raw text."""
+    if os.path.isfile(path):
+        with open(path) as fh:
+            return fh.read()
+    elif os.path.isdir(path):
+        return corpus_reader(path).raw()
+
+
+def source_files(path):
+    """Return a list with the path of the file or the paths of the files in the
+    directory."""
+    if os.path.isfile(path):
+        return [path]
+    elif os.path.isdir(path):
+        return [os.path.join(path, fileid) for fileid in corpus_reader(path).fileids()]
+    return []
+
+
+def open_sources(path):
+    """Generate open file handles for the file or for each of the files in the
+    directory. The caller is responsible for closing them."""
+    if os.path.isfile(path):
+        yield open(path)
+    elif os.path.isdir(path):
+        corpus = corpus_reader(path)
+        for fileid in corpus.fileids():
+            yield corpus.open(fileid)
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """Generate the raw text of the file or directory as a sequence of strings of
+    about chunk_size characters, each ending at a boundary."""
+    for fh in open_sources(path):
+        with fh:
+            yield from chunk_stream(fh, chunk_size)
+
+
+def chunk_stream(fh, chunk_size=CHUNK_SIZE):
+    """Generate chunks from an open file handle. Data is collected in a list of
+    pieces and only joined when we look for a boundary, which happens when
+    there is at least chunk_size of data and, if there was no boundary the last
+    time, when the data has doubled since then. This keeps the time spent on
+    looking for boundaries linear in the size of the data."""
+    pieces = []
+    size = 0
+    wanted = chunk_size
+    while True:
+        data = fh.read(chunk_size)
+        if not data:
+            break
+        pieces.append(data)
+        size += len(data)
+        if size < wanted:
+            continue
+        buffer = ''.join(pieces)
+        boundary = find_boundary(buffer)
+        if boundary is None:
+            pieces = [buffer]
+            wanted = 2 * size
+        else:
+            yield buffer[:boundary]
+            pieces = [buffer[boundary:]]
+            size = len(pieces[0])
+            wanted = max(chunk_size, 2 * size)
+    if size:
+        yield ''.join(pieces)
+
+
+def find_boundary(text):
+    """Return the offset of the start of the next to last sentence of the text,
+    as found by nltk.sent_tokenize(), or None if the text has less than three
+    sentences. The last sentence may be incomplete, and the boundary before it
+    may depend on how it continues, but the boundary before the next to last
+    sentence is final."""
+    sentences = nltk.sent_tokenize(text)
+    if len(sentences) < 3:
+        return None
+    # sentences are slices of the text, so we can find where each one starts
+    offset = 0
+    for sentence in sentences[:-1]:
+        offset = text.index(sentence, offset)
+        start = offset
+        offset += len(sentence)
+    return start
+
+
+def stream_tokens(path, chunk_size=CHUNK_SIZE):
+    """Generate the tokens of the file or directory, tokenizing one chunk at a
+    time."""
+    for chunk in read_chunks(path, chunk_size):
+        yield from nltk.word_tokenize(chunk)
+
+
+class TokenStream(object):
+
+    """A lazy sequence of the tokens in a file or directory. Unlike a generator
+    it can be iterated over more than once, each iteration streams the source
+    again. There is deliberately no __len__ since getting the length requires a
+    full pass over the data."""
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def __str__(self):
+        return "<TokenStream %s>" % self.path
+
+    def __iter__(self):
+        return stream_tokens(self.path, self.chunk_size)
+
+    def chunks(self):
+        return read_chunks(self.path, self.chunk_size)
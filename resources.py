@@ -0,0 +1,163 @@
+"""resources.py
+
+Separate module for word lists that take a while to load, like the stop list and
+the English vocabulary. They are only loaded when they are first used so that
+importing a module that defines them is fast.
+
+The word lists can be frozen into text files with one word per line with
+
+$ python resources.py
+
+and a program that wants to use those instead of the NLTK corpora calls
+load_frozen() before the word lists are first used. Nothing is read from the
+frozen files unless load_frozen() is called.
+
+"""
+
+import os
+from collections.abc import Set
+
+import nltk
+
+
+# Directory next to this module that freeze() writes the word lists to and that
+# load_frozen() reads them from by default
+FROZEN_RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frozen_resources')
+
+
+def load_stoplist():
+    # NLTK stoplist with 3136 words (multilingual)
+    return frozenset(nltk.corpus.stopwords.words())
+
+
+def load_english_vocabulary():
+    # Vocabulary with 234,377 English words from NLTK
+    return frozenset(w.lower() for w in nltk.corpus.words.words())
+
+
+class LazyWordSet(Set):
+
+    """A set of words that is loaded with a loader function the first time it is
+    used, unless load_frozen() gave it its words. It can be used like a frozenset:
+    besides membership tests, iteration and len() it has the set operators and
+    the named set methods, which all work on the loaded words."""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.words = None
+
+    def __str__(self):
+        loaded = 'unloaded' if self.words is None else "size=%d" % len(self.words)
+        return "<LazyWordSet %s %s>" % (self.name, loaded)
+
+    def load(self):
+        """Return the words as a frozenset, loading them if needed."""
+        if self.words is None:
+            self.words = self.loader()
+        return self.words
+
+    def __contains__(self, word):
+        return word in self.load()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    # the operators and methods of the Set mixin would loop over all words in
+    # Python, so they are handed to the frozenset instead
+
+    def __and__(self, other):
+        return self.load() & frozenset(other)
+
+    def __or__(self, other):
+        return self.load() | frozenset(other)
+
+    def __sub__(self, other):
+        return self.load() - frozenset(other)
+
+    def __xor__(self, other):
+        return self.load() ^ frozenset(other)
+
+    def __rand__(self, other):
+        return frozenset(other) & self.load()
+
+    def __ror__(self, other):
+        return frozenset(other) | self.load()
+
+    def __rsub__(self, other):
+        return frozenset(other) - self.load()
+
+    def __rxor__(self, other):
+        return frozenset(other) ^ self.load()
+
+    def intersection(self, *others):
+        return self.load().intersection(*others)
+
+    def union(self, *others):
+        return self.load().union(*others)
+
+    def difference(self, *others):
+        return self.load().difference(*others)
+
+    def symmetric_difference(self, other):
+        return self.load().symmetric_difference(other)
+
+    def issubset(self, other):
+        return self.load().issubset(other)
+
+    def issuperset(self, other):
+        return self.load().issuperset(other)
+
+    def isdisjoint(self, other):
+        return self.load().isdisjoint(other)
+
+    def copy(self):
+        return self.load()
+
+
+STOPLIST = LazyWordSet('stoplist', load_stoplist)
+ENGLISH_VOCABULARY = LazyWordSet('english_vocabulary', load_english_vocabulary)
+
+WORD_SETS = (STOPLIST, ENGLISH_VOCABULARY)
+
+
+def frozen_file(directory, word_set):
+    return os.path.join(directory, "%s.txt" % word_set.name)
+
+
+def load_frozen(directory=FROZEN_RESOURCES, word_sets=WORD_SETS):
+    """Give the word sets that are not loaded yet the words that freeze() wrote to
+    the directory. Word sets without a file, or whose file was frozen with
+    another version of NLTK, are left to their loader. Returns the names of the
+    word sets that were loaded from the directory."""
+    loaded = []
+    for word_set in word_sets:
+        filename = frozen_file(directory, word_set)
+        if word_set.words is not None or not os.path.isfile(filename):
+            continue
+        with open(filename, encoding='utf-8') as fh:
+            if fh.readline() != "# nltk %s\n" % nltk.__version__:
+                continue
+            word_set.words = frozenset(line.rstrip('\n') for line in fh)
+        loaded.append(word_set.name)
+    return loaded
+
+
+def freeze(directory=FROZEN_RESOURCES, word_sets=WORD_SETS):
+    """Load the word sets with their loaders and write each to a file in the
+    directory, one word per line after a line with the version of NLTK."""
+    os.makedirs(directory, exist_ok=True)
+    for word_set in word_sets:
+        with open(frozen_file(directory, word_set), 'w', encoding='utf-8') as fh:
+            fh.write("# nltk %s\n" % nltk.__version__)
+            for word in sorted(word_set.loader()):
+                fh.write("%s\n" % word)
+
+
+if __name__ == '__main__':
+
+    freeze()
+    print("Froze %s in %s" % (', '.join(w.name for w in WORD_SETS), FROZEN_RESOURCES))
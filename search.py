@@ -0,0 +1,104 @@
+"""search.py
+
+Separate module for regular expression search on raw text.
+
+Compiled patterns are cached, and a PatternSet holds a set of named patterns
+that are all searched for in a text. Each pattern is run with re.finditer(),
+which is faster than any way of combining the patterns into one regular
+expression since the re module has no way of finding the matches of several
+patterns in one pass.
+
+A PatternSet can also search text that comes in chunks. A match is only taken
+when it ends some distance before the end of the text read so far, otherwise it
+is tried again when the next chunk is in, so that matches that span chunks are
+the same as in the whole text. The text after the last match of each pattern is
+kept until the next chunk comes in, but never more than OVERLAP characters of
+it, so only a match that is longer than that and that spans chunks can be
+missed.
+
+"""
+
+import re
+from functools import lru_cache
+from collections import namedtuple
+
+
+# Maximum number of characters kept from one chunk to the next for a pattern
+# that has no match in them yet, a match that starts before that and spans a
+# chunk boundary is missed
+OVERLAP = 2 ** 16
+
+# Number of characters kept before the first position searched, so that things
+# like \b and lookbehinds have some context, and the minimum distance between
+# the end of a match and the end of the text read so far, so that lookaheads
+# and optional parts at the end of a pattern can see the next chunk
+CONTEXT = 16
+
+# A match when scanning chunks, the offset is the start of the match in the
+# whole text, not in the chunk
+ChunkMatch = namedtuple('ChunkMatch', ['name', 'offset', 'match'])
+
+
+@lru_cache(maxsize=512)
+def compile_pattern(pattern, flags=0):
+    """Return a compiled regular expression, compiling it only once."""
+    return re.compile(pattern, flags)
+
+
+class PatternSet(object):
+
+    """A set of named patterns that are searched for together. Patterns are given
+    as a dictionary indexed on names with as values either a pattern or a
+    (pattern, flags) pair."""
+
+    def __init__(self, patterns):
+        self.names = []
+        self.regexes = []
+        for name, pattern in patterns.items():
+            pattern, flags = (pattern, 0) if isinstance(pattern, str) else pattern
+            self.names.append(name)
+            self.regexes.append(compile_pattern(pattern, flags))
+
+    def __str__(self):
+        return "<PatternSet %s>" % ' '.join(self.names)
+
+    def search(self, text):
+        """Return a dictionary indexed on pattern names with for each pattern a list
+        with its matches in the text."""
+        return {name: list(regex.finditer(text))
+                for name, regex in zip(self.names, self.regexes)}
+
+    def scan_chunks(self, chunks, overlap=OVERLAP):
+        """Generate a ChunkMatch for each match in a text that is given as a sequence
+        of strings. The matches of each pattern are in order of their offsets
+        and are the same as for the whole text, except for matches longer than
+        the overlap that span a chunk boundary."""
+        buffer = ''
+        base = 0
+        # for each pattern the position in the buffer where searching continues
+        positions = [0] * len(self.names)
+        for chunk in chunks:
+            buffer += chunk
+            end = len(buffer) - CONTEXT
+            for i, regex in enumerate(self.regexes):
+                for match in regex.finditer(buffer, positions[i]):
+                    if match.end() > end:
+                        # this match could still change with more text
+                        break
+                    positions[i] = next_position(match)
+                    yield ChunkMatch(self.names[i], base + match.start(), match)
+            # give up on what is too far back and drop what is not needed anymore
+            positions = [max(p, len(buffer) - overlap) for p in positions]
+            cut = max(0, min(positions) - CONTEXT)
+            buffer = buffer[cut:]
+            base += cut
+            positions = [p - cut for p in positions]
+        for i, regex in enumerate(self.regexes):
+            for match in regex.finditer(buffer, positions[i]):
+                yield ChunkMatch(self.names[i], base + match.start(), match)
+
+
+def next_position(match):
+    """Return where finditer() continues after a match, an empty match is not
+    followed by another match at the same position."""
+    return match.end() if match.end() > match.start() else match.end() + 1
@@ -0,0 +1,91 @@
+"""tagging.py
+
+Separate module for part-of-speech tagging of whole texts.
+
+Sentences are tagged in batches and the batches are spread over a pool of worker
+processes, each of which loads the tagger model only once. The result is a list
+of tags and an array with a tag id for each token, which is stored in the cache
+next to the tokenization. The cache key uses the content of the source files
+and the versions of the tokenizer and the tagger, so the tags are reused until
+one of those changes.
+
+"""
+
+from array import array
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+import nltk
+
+from cache import CACHE_DIR, TOKENIZER, load_artifact, store_artifact
+
+
+# The tagger, as part of the cache key
+TAGGER = 'nltk.PerceptronTagger/%s' % nltk.__version__
+
+# Tags depend on the tokens as well as on the tagger
+TAG_VERSION = "%s %s" % (TOKENIZER, TAGGER)
+
+# Number of sentences sent to a worker process at a time
+BATCH_SIZE = 500
+
+# The tagger used in this process, loaded on first use
+TAGGER_INSTANCE = None
+
+
+def get_tagger():
+    global TAGGER_INSTANCE
+    if TAGGER_INSTANCE is None:
+        TAGGER_INSTANCE = nltk.tag.PerceptronTagger()
+    return TAGGER_INSTANCE
+
+
+def tag_batch(sentences):
+    """Return the tags for a list of sentences, as a list of lists of tags. Only
+    the tags are returned, the words are already known to the caller."""
+    return [[tag for word, tag in sentence] for sentence in get_tagger().tag_sents(sentences)]
+
+
+def batches(sentences, batch_size=BATCH_SIZE):
+    """Generate lists of at most batch_size sentences."""
+    sentences = iter(sentences)
+    while True:
+        batch = list(islice(sentences, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+def tag_sentences(sentences, workers=None, batch_size=BATCH_SIZE):
+    """Return the tags and an array with a tag id for each token of a sequence of
+    sentences. Batches are tagged in at most the given number of worker
+    processes (the default is the number of CPUs), with workers=1 or if there is
+    only one batch no processes are started. Tags are in the order of the
+    sentences, whatever the order in which the batches finish."""
+    all_batches = list(batches(sentences, batch_size))
+    if workers == 1 or len(all_batches) < 2:
+        tagged = map(tag_batch, all_batches)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tagged = list(executor.map(tag_batch, all_batches))
+    tag_index = {}
+    tag_ids = array('H')
+    for batch in tagged:
+        for sentence in batch:
+            tag_ids.extend(tag_index.setdefault(tag, len(tag_index)) for tag in sentence)
+    return list(tag_index), tag_ids
+
+
+def load_tags(path, cache_dir=CACHE_DIR):
+    """Return the cached tags and tag ids of the file or directory, or None."""
+    cached = load_artifact(path, 'tags', cache_dir, content_hash=True, version=TAG_VERSION)
+    if cached is None:
+        return None
+    meta, arrays = cached
+    return meta['tags'], arrays['tag_ids']
+
+
+def store_tags(path, tags, tag_ids, cache_dir=CACHE_DIR):
+    meta = {'path': path, 'tagger': TAGGER, 'tags': tags}
+    store_artifact(path, 'tags', meta, {'tag_ids': tag_ids}, cache_dir,
+                   content_hash=True, version=TAG_VERSION)
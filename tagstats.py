@@ -0,0 +1,123 @@
+"""tagstats.py
+
+Separate module to calculate statistics on a tagged sequence of tokens. Two
+tables are created in one pass over the arrays of word ids and tag ids: one
+with counts for each (word, tag) pair and one with counts for each pair of
+adjacent tags. All questions on the tagged sequence are then answered from
+those tables, which takes time proportional to the size of the vocabulary and
+not to the number of tokens.
+
+Anything that is tagged, like the Brown corpus or a tagged Text, is a subclass of
+TaggedSequence, so the same question functions work on all of them.
+
+"""
+
+from collections import Counter
+from itertools import islice
+
+
+# Tags for singular and plural regular nouns in the Brown tag set
+SINGULAR_NOUN = 'NN'
+PLURAL_NOUN = 'NNS'
+
+# All nouns have a tag starting with this, in Brown as well as in the Penn tag set
+NOUN_PREFIX = 'NN'
+
+
+class TaggedSequence(object):
+
+    """Base class for tagged sequences. Subclasses implement tag_arrays(), which
+    returns a list of words, a list of tags, and arrays with a word id and a tag
+    id for each token, and which may tag the sequence the first time it is
+    called. They should also set tag_statistics to None when initialized."""
+
+    tag_statistics = None
+
+    def tag_arrays(self):
+        raise NotImplementedError()
+
+    def tag_stats(self):
+        """Return the tag statistics, calculating them only once."""
+        if self.tag_statistics is None:
+            self.tag_statistics = TagStatistics(*self.tag_arrays())
+        return self.tag_statistics
+
+    def tagged_words(self):
+        """Generate all tokens as (word, tag) pairs."""
+        words, tags, word_ids, tag_ids = self.tag_arrays()
+        return zip(map(words.__getitem__, word_ids), map(tags.__getitem__, tag_ids))
+
+
+class TagStatistics(object):
+
+    """Statistics for a tagged sequence given as a list of words, a list of tags
+    and arrays with a word id and a tag id for each token. Counting is done by
+    Counter on pairs of ids, so the tokens are never looked at in Python."""
+
+    def __init__(self, words, tags, word_ids, tag_ids):
+        self.words = words
+        self.tags = tags
+        self.tokens = len(word_ids)
+        self.word_tags = Counter(zip(word_ids, tag_ids))
+        self.tag_bigrams = Counter(zip(tag_ids, islice(tag_ids, 1, None)))
+        self.tag_counts = Counter()
+        self.word_counts = Counter()
+        # for each word id the tag ids it occurs with, in order of tag id
+        self.tags_of_word = {}
+        for (word_id, tag_id), count in sorted(self.word_tags.items()):
+            self.tag_counts[tag_id] += count
+            self.word_counts[word_id] += count
+            self.tags_of_word.setdefault(word_id, []).append(tag_id)
+
+    def __str__(self):
+        return "<TagStatistics tokens=%d words=%d tags=%d>" \
+            % (self.tokens, len(self.word_counts), len(self.tag_counts))
+
+    def nouns_more_common_in_plural_form(self):
+        """Return the (lower cased) nouns that occur more often with the regular
+        plural -s suffix than without it."""
+        singular = self.lower_case_counts(SINGULAR_NOUN)
+        plural = self.lower_case_counts(PLURAL_NOUN)
+        return [word[:-1] for word, count in plural.items()
+                if word.endswith('s') and count > singular.get(word[:-1], 0)]
+
+    def which_word_has_greatest_number_of_distinct_tags(self):
+        """Return a list of (word, tags) pairs for the words with the most tags."""
+        most = max(map(len, self.tags_of_word.values()), default=0)
+        return [(self.words[word_id], [self.tags[t] for t in tag_ids])
+                for word_id, tag_ids in self.tags_of_word.items() if len(tag_ids) == most]
+
+    def tags_in_order_of_decreasing_frequency(self):
+        return [(self.tags[t], count) for t, count in self.tag_counts.most_common()]
+
+    def tags_that_nouns_are_most_commonly_found_after(self):
+        nouns = set(t for t, tag in enumerate(self.tags) if tag.startswith(NOUN_PREFIX))
+        counts = Counter()
+        for (previous, tag_id), count in self.tag_bigrams.items():
+            if tag_id in nouns:
+                counts[previous] += count
+        return [(self.tags[t], count) for t, count in counts.most_common()]
+
+    def proportion_ambiguous_word_types(self):
+        """Return the proportion of word types that occur with more than one tag."""
+        if not self.tags_of_word:
+            return 0.0
+        return len(self.ambiguous_words()) / len(self.tags_of_word)
+
+    def proportion_ambiguous_word_tokens(self):
+        """Return the proportion of tokens whose word occurs with more than one tag."""
+        if not self.tokens:
+            return 0.0
+        return sum(map(self.word_counts.__getitem__, self.ambiguous_words())) / self.tokens
+
+    def ambiguous_words(self):
+        return [w for w, tag_ids in self.tags_of_word.items() if len(tag_ids) > 1]
+
+    def lower_case_counts(self, tag):
+        """Return a Counter with the lower cased words that occur with the tag."""
+        counts = Counter()
+        tag_id = self.tags.index(tag) if tag in self.tags else None
+        for (word_id, t), count in self.word_tags.items():
+            if t == tag_id:
+                counts[self.words[word_id].lower()] += count
+        return counts
@@ -1,11 +1,26 @@
+import os
 import sys
+import shutil
+import tempfile
 import unittest
+import math
+import subprocess
 import warnings
 from io import StringIO
 
 from main import read_text, token_count, type_count, sentence_count
 from main import most_frequent_content_words, most_frequent_bigrams
-from main import Vocabulary
+from main import Vocabulary, get_corpus_vocabs
+from main import get_dimensions, create_category_vectors
+from main import CategoryModel, similarity_matrix, compare_to_brown
+from main import weigh, get_idf, create_text_vectors, BM25_K1, BM25_B
+from main import HashedDimensions, is_content_word
+from reader import chunk_stream
+from cache import tokenize, load_tokens
+from resources import LazyWordSet, freeze, load_frozen
+
+import nltk
+from nltk.probability import FreqDist
 
 
 def ignore_warnings(test_func):
@@ -112,6 +127,23 @@ class BasicTests(unittest.TestCase):
         frequencies = [w[1] for w in most_frequent_bigrams(self.emma)]
         self.assertTrue(min(frequencies) > 20)
 
+    def test_streamed_statistics(self):
+        """Statistics on a streamed text are the same as on the full text."""
+        stream = read_text('data/grail.txt', stream=True)
+        self.assertEqual(token_count(stream), token_count(self.grail))
+        self.assertEqual(type_count(stream), type_count(self.grail))
+        self.assertEqual(sentence_count(stream), sentence_count(self.grail))
+
+    def test_chunks_without_paragraphs(self):
+        """Chunks of a text without empty lines still give the same tokens."""
+        raw = "Mr. Smith went to Washington. He said \"No.\" Then he left. " * 40
+        for chunk_size in (1, 7, 100):
+            chunks = list(chunk_stream(StringIO(raw), chunk_size))
+            self.assertEqual(''.join(chunks), raw)
+            self.assertTrue(len(chunks) > 1)
+            tokens = [t for chunk in chunks for t in nltk.word_tokenize(chunk)]
+            self.assertEqual(tokens, nltk.word_tokenize(raw))
+
 
 class TestVocabulary(unittest.TestCase):
 
@@ -192,6 +224,299 @@ class TestVocabulary(unittest.TestCase):
             sys.stdout = stdout
 
 
+class TokenCacheTests(unittest.TestCase):
+
+    """The tokenization cache, using a temporary cache directory and a copy of a
+    source file that can be changed."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.path = os.path.join(self.directory, 'grail.txt')
+        shutil.copy('data/grail.txt', self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """Cached tokens are loaded and are the same as the tokenized text."""
+        self.assertIsNone(load_tokens(self.path, self.cache_dir))
+        tokens = tokenize(self.path, self.cache_dir)
+        cached = load_tokens(self.path, self.cache_dir)
+        self.assertEqual(list(cached), list(tokens))
+        self.assertEqual(list(cached), list(read_text(self.path, cache=False)))
+        self.assertEqual(list(cached.sentence_ends), list(tokens.sentence_ends))
+
+    def test_invalidation(self):
+        """Changing the modification time or the size of a file invalidates its cache."""
+        tokenize(self.path, self.cache_dir)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(load_tokens(self.path, self.cache_dir))
+        tokenize(self.path, self.cache_dir)
+        with open(self.path, 'a') as fh:
+            fh.write("ARTHUR: Ni!\n")
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(load_tokens(self.path, self.cache_dir))
+        self.assertEqual(tokenize(self.path, self.cache_dir)[-4:], ['ARTHUR', ':', 'Ni', '!'])
+
+    def test_missing_path(self):
+        """There is nothing to tokenize or cache for a path that does not exist."""
+        missing = os.path.join(self.directory, 'missing.txt')
+        self.assertIsNone(tokenize(missing, self.cache_dir))
+        self.assertIsNone(read_text(missing))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class LazyWordSetTests(unittest.TestCase):
+
+    def test_import_does_not_load(self):
+        """Importing main does not load the stop list or the English vocabulary."""
+        code = ("import main, resources; "
+                "print([w.words is None for w in resources.WORD_SETS])")
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.split(), [b'[True,', b'True]'])
+
+    def test_set_operations(self):
+        """A lazy word set works like a frozenset."""
+        words = LazyWordSet('test', lambda: frozenset(['a', 'b', 'c']))
+        self.assertIsNone(words.words)
+        self.assertEqual(words | {'d'}, {'a', 'b', 'c', 'd'})
+        self.assertEqual({'c', 'd'} | words, {'a', 'b', 'c', 'd'})
+        self.assertEqual(words - {'a'}, {'b', 'c'})
+        self.assertEqual({'a', 'd'} - words, {'d'})
+        self.assertEqual(words & {'a', 'd'}, {'a'})
+        self.assertEqual({'a', 'd'} & words, {'a'})
+        self.assertEqual(words ^ {'a', 'd'}, {'b', 'c', 'd'})
+        self.assertEqual({'a', 'b'}.intersection(words), {'a', 'b'})
+        self.assertEqual(words.intersection(['a', 'x']), {'a'})
+        self.assertEqual(words.union(['x']), {'a', 'b', 'c', 'x'})
+        self.assertEqual(words.difference(['a'], ['b']), {'c'})
+        self.assertTrue(words.issuperset(['a']) and words.issubset('abcd'))
+        self.assertTrue(words.isdisjoint(['x']))
+        self.assertTrue(words == frozenset('abc') and {'a'} < words)
+
+    def test_frozen(self):
+        """Frozen word sets are only used after load_frozen() and only for word sets
+        that were not loaded yet."""
+        directory = tempfile.mkdtemp()
+        try:
+            freeze(directory, [LazyWordSet('test', lambda: frozenset(['a', 'b']))])
+            words = LazyWordSet('test', lambda: frozenset(['c']))
+            other = LazyWordSet('other', lambda: frozenset(['d']))
+            self.assertEqual(load_frozen(directory, [words, other]), ['test'])
+            self.assertEqual(words, {'a', 'b'})
+            self.assertEqual(other, {'d'})
+            words = LazyWordSet('test', lambda: frozenset(['c']))
+            self.assertEqual(words, {'c'})
+            self.assertEqual(load_frozen(directory, [words]), [])
+        finally:
+            shutil.rmtree(directory)
+
+
+class CorpusVocabularyTests(unittest.TestCase):
+
+    """Vocabularies counted in worker processes."""
+
+    @classmethod
+    def setUpClass(cls):
+        paths = {'grail': 'data/grail.txt', 'wsj': 'data/wsj'}
+        cls.sequential = get_corpus_vocabs(paths, workers=1)
+        cls.parallel = get_corpus_vocabs(paths, workers=2)
+
+    def test_same_counts(self):
+        """Counting in one process or in two gives the same frequencies."""
+        for name in ('grail', 'wsj'):
+            self.assertEqual(self.sequential[name].fdist, self.parallel[name].fdist)
+            self.assertEqual(self.sequential[name].text_size, self.parallel[name].text_size)
+        self.assertEqual(self.parallel['grail'].text_size, len(read_text('data/grail.txt')))
+
+    def test_kwic(self):
+        """The kwic still works even though the text was counted elsewhere."""
+        try:
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            self.parallel['grail'].kwic('swallow')
+            keywords = [w for w in sys.stdout.getvalue().split() if w.lower() == 'swallow']
+            self.assertTrue(len(keywords) > 5)
+        finally:
+            sys.stdout = stdout
+
+
+def vocabulary(**counts):
+    """Create a Vocabulary from word counts, all words used in the tests below are
+    in the English vocabulary."""
+    return Vocabulary(None, counts=FreqDist(counts))
+
+
+def dense_cosine(v1, v2):
+    """The cosine of two vectors computed on all their weights, including zeros."""
+    w1, w2 = list(v1), list(v2)
+    dot_product = sum(a * b for a, b in zip(w1, w2))
+    return dot_product / (math.sqrt(sum(a * a for a in w1)) * math.sqrt(sum(b * b for b in w2)))
+
+
+class VectorTests(unittest.TestCase):
+
+    """Vectors and category models on small vocabularies that are made up, so
+    these tests do not need any corpora."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.vocabs = {
+            'birds': vocabulary(the=20, swallow=12, fly=7, south=3, time=1),
+            'court': vocabulary(the=8, king=9, knight=5, time=4, swallow=1),
+            'food': vocabulary(the=3, coconut=6, swallow=2, time=2),
+            'road': vocabulary(the=2, south=5, king=1, fly=2, knight=1)}
+        cls.texts = [vocabulary(swallow=4, coconut=1, king=2),
+                     vocabulary(knight=3, south=1, time=6),
+                     vocabulary(coconut=1)]
+
+    def test_cosine(self):
+        """The sparse cosine is the same as the cosine on the dense weights."""
+        dimensions = get_dimensions(self.vocabs)
+        for weight in ('frequency', 'binary', 'log'):
+            vectors = create_category_vectors(dimensions, self.vocabs, weight)
+            for v1 in vectors.values():
+                self.assertEqual(len(list(v1)), len(dimensions))
+                for v2 in vectors.values():
+                    self.assertAlmostEqual(v1.cosine(v2), dense_cosine(v1, v2), places=12)
+
+    def test_indexing(self):
+        """A vector is indexed like the list of its weights, negative indices too."""
+        dimensions = get_dimensions(self.vocabs)
+        vector = create_category_vectors(dimensions, self.vocabs)['birds']
+        weights = list(vector)
+        for i in range(-len(weights), len(weights)):
+            self.assertEqual(vector[i], weights[i])
+        for i in (len(weights), -len(weights) - 1):
+            self.assertRaises(IndexError, vector.__getitem__, i)
+        vector[-1] = 5
+        self.assertEqual(vector[len(weights) - 1], 5)
+        self.assertEqual(vector.sum, sum(weights[:-1]) + 5)
+
+    def test_dimensions(self):
+        """The dimensions can be limited to content words, to words that occur in at
+        least min_df vocabularies and to the top_k most frequent words."""
+        all_words = ['coconut', 'fly', 'king', 'knight', 'south', 'swallow', 'the', 'time']
+        self.assertEqual(get_dimensions(self.vocabs), all_words)
+        content_words = get_dimensions(self.vocabs, content_words=True)
+        self.assertEqual(content_words, [w for w in all_words if is_content_word(w)])
+        self.assertNotIn('the', content_words)
+        self.assertEqual(get_dimensions(self.vocabs, min_df=2),
+                         [w for w in all_words if w != 'coconut'])
+        self.assertEqual(get_dimensions(self.vocabs, min_df=4), ['the'])
+        self.assertEqual(get_dimensions(self.vocabs, top_k=3), ['king', 'swallow', 'the'])
+        # knight and coconut both occur 6 times, the tie is broken on the word
+        self.assertEqual(get_dimensions(self.vocabs, top_k=7),
+                         [w for w in all_words if w != 'knight'])
+        self.assertEqual(get_dimensions(self.vocabs, content_words=True, min_df=2, top_k=2),
+                         ['king', 'swallow'])
+
+    def test_hashed_dimensions(self):
+        """With buckets, words are hashed into a fixed number of dimensions."""
+        dimensions = get_dimensions(self.vocabs, buckets=3, top_k=1)
+        self.assertEqual(dimensions, HashedDimensions(3))
+        self.assertEqual(len(dimensions), 3)
+        vectors = create_category_vectors(dimensions, self.vocabs)
+        for cat, vector in vectors.items():
+            self.assertEqual(len(list(vector)), 3)
+            self.assertEqual(sum(vector), self.vocabs[cat].fdist.N())
+
+    def test_saved_dimensions(self):
+        """The options for the dimensions are saved with a model."""
+        model = CategoryModel.from_vocabularies(self.vocabs, 'tfidf', min_df=2, top_k=5)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'test.model')
+            model.save(filename)
+            loaded = CategoryModel.load(filename)
+            self.assertEqual(loaded.options, {'min_df': 2, 'top_k': 5})
+            self.assertEqual(loaded.dimensions, get_dimensions(self.vocabs, min_df=2, top_k=5))
+            self.assertEqual(len(loaded.idf), 5)
+            del loaded
+
+    def test_weights(self):
+        """Each weight gives the expected values for a small table of counts."""
+        counts = {0: 1, 1: 4, 3: 2}
+        idf = [0.5, 0.0, 2.0, 1.5]
+        self.assertEqual(weigh(counts, 'frequency'), counts)
+        self.assertEqual(weigh(counts, 'binary'), {0: 1, 1: 1, 3: 1})
+        self.assertEqual(weigh(counts, 'log'), {0: 1, 1: 1 + math.log(4), 3: 1 + math.log(2)})
+        # a term with an idf of zero gets no weight at all
+        self.assertEqual(weigh(counts, 'tfidf', idf), {0: 0.5, 3: 3.0})
+        bm25 = weigh(counts, 'bm25', idf, length=7, avgdl=14)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * 7 / 14)
+        self.assertEqual(sorted(bm25), [0, 3])
+        self.assertAlmostEqual(bm25[3], 2 * (BM25_K1 + 1) / (2 + norm) * 1.5)
+        with self.assertRaises(ValueError):
+            weigh(counts, 'tf')
+
+    def test_idf_required(self):
+        """Tf-idf and BM25 vectors can not be created without an idf table."""
+        dimensions = get_dimensions(self.vocabs)
+        for weight in ('tfidf', 'bm25'):
+            with self.assertRaises(ValueError):
+                create_text_vectors(dimensions, {'text': self.texts[0]}, weight)
+
+    def test_idf(self):
+        """The idf depends on the number of categories that a term occurs in."""
+        dimensions = get_dimensions(self.vocabs)
+        binary = create_category_vectors(dimensions, self.vocabs, 'binary')
+        idf = dict(zip(dimensions, get_idf(binary, len(dimensions))))
+        self.assertAlmostEqual(idf['swallow'], math.log(4 / 3))
+        self.assertAlmostEqual(idf['coconut'], math.log(4))
+        self.assertAlmostEqual(idf['king'], math.log(2))
+        bm25_idf = get_idf(binary, len(dimensions), 'bm25')
+        self.assertTrue(all(value > 0 for value in bm25_idf))
+
+    def test_similarity_matrix(self):
+        """The similarity matrix has the cosines of each text with each category."""
+        for weight in ('frequency', 'log', 'tfidf', 'bm25'):
+            model = CategoryModel.from_vocabularies(self.vocabs, weight)
+            matrix = similarity_matrix(self.texts, model)
+            self.assertEqual(len(matrix), len(self.texts))
+            for text, row in zip(self.texts, matrix):
+                vector = model.vector(text)
+                expected = [vector.cosine(model.vectors[cat]) if vector.magnitude else 0.0
+                            for cat in model.categories]
+                for score, cosine in zip(row, expected):
+                    self.assertAlmostEqual(score, cosine, places=12)
+
+    def test_saved_model(self):
+        """A saved model is loaded with the same options and gives the same scores,
+        and its matrix is not copied out of the file."""
+        options = [{}, {'top_k': 4}, {'min_df': 2, 'content_words': True}, {'buckets': 3}]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'test.model')
+            for weight in ('frequency', 'binary', 'log', 'tfidf', 'bm25'):
+                for option in options:
+                    model = CategoryModel.from_vocabularies(self.vocabs, weight, **option)
+                    model.save(filename)
+                    loaded = CategoryModel.load(filename)
+                    self.assertIsInstance(loaded.matrix.weights, memoryview)
+                    self.assertEqual(loaded.options, option)
+                    self.assertEqual(loaded.weight, weight)
+                    self.assertEqual(loaded.categories, model.categories)
+                    self.assertEqual(loaded.dimensions, model.dimensions)
+                    self.assertEqual(loaded.similarities(self.texts),
+                                     model.similarities(self.texts))
+                    del loaded
+
+    def test_compare_to_brown(self):
+        """Comparing a text prints the scores and returns them."""
+        model = CategoryModel.from_vocabularies(self.vocabs)
+        try:
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            scores = compare_to_brown(self.texts[0], model=model)
+            printed = sys.stdout.getvalue().split()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(list(scores), model.categories)
+        self.assertEqual(list(scores.values()), similarity_matrix(self.texts[:1], model)[0])
+        self.assertEqual(printed[:2], ['birds', "%.2f" % scores['birds']])
+
+
 if __name__ == '__main__':
 
     unittest.main()
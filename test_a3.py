@@ -7,12 +7,16 @@ work with the new interface. The third case is new.
 """
 
 
+import re
 import sys
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 from io import StringIO
 
 from main_a3 import Text, Vocabulary
+from fsa import FSA, Predicate
+from search import PatternSet
 
 
 def ignore_warnings(test_func):
@@ -118,6 +122,25 @@ class BasicTests(unittest.TestCase):
         frequencies = [w[1] for w in self.emma.most_frequent_bigrams()]
         self.assertTrue(min(frequencies) > 20)
 
+    def test_stats_cached(self):
+        """Statistics are calculated once and agree with the token count."""
+        stats = self.grail.stats()
+        self.assertIs(stats, self.grail.stats())
+        self.assertEqual(stats.tokens, self.grail.token_count())
+        self.assertEqual(stats.types, self.grail.type_count())
+
+    def test_streamed_text(self):
+        """A streamed text without a token cache can be iterated over and counted
+        and gives the same vocabulary as the full text, but it cannot be indexed."""
+        stream = Text('data/grail.txt', stream=True, cache=False)
+        self.assertEqual(list(stream), list(self.grail))
+        self.assertEqual(len(stream), len(self.grail))
+        with self.assertRaises(TypeError):
+            stream[0]
+        vocab = Vocabulary(stream)
+        self.assertEqual(vocab.text_size, len(self.grail))
+        self.assertEqual(vocab.fdist, Vocabulary(self.grail).fdist)
+
 
 class TestVocabulary(unittest.TestCase):
 
@@ -198,6 +221,13 @@ class TestVocabulary(unittest.TestCase):
         finally:
             sys.stdout = stdout
 
+    def test_text_kwic_paging(self):
+        """The KWIC on a text returns lines that can be paged through."""
+        lines = self.text.kwic('swallow', limit=None)
+        self.assertTrue(8 < len(lines) < 12)
+        self.assertEqual(self.text.kwic('swallow', offset=2, limit=3), lines[2:5])
+        self.assertEqual(lines[0].query.lower(), 'swallow')
+
 
 class TestSearch(unittest.TestCase):
 
@@ -207,6 +237,8 @@ class TestSearch(unittest.TestCase):
         cls.grail = Text('data/grail.txt')
         cls.roles = cls.grail.find_roles()
         cls.repeated = cls.grail.find_repeated_words()
+        cls.sirs = FSA('sirs', ['S0', 'S1', 'S2'], ['S2'],
+                       [('S0', 'Sir', 'S1'), ('S1', 'Robin', 'S2'), ('S1', 'Lancelot', 'S2')])
 
     def test_sirs(self):
         answer = set(['Sir Bedevere', 'Sir Galahad', 'Sir Gallahad', 'Sir Knight', 'Sir Lancelot',
@@ -234,6 +266,123 @@ class TestSearch(unittest.TestCase):
     def test_repeated_squeak(self):
         self.assertTrue('squeak squeak squeak' in self.repeated)
 
+    def test_pattern_set(self):
+        """A pattern set finds the same matches as re.finditer() with each pattern,
+        also when the text comes in chunks that cut through matches."""
+        patterns = {'sirs': r"\bSir \S+\b",
+                    'roles': (r"^([A-Z]{2,}[^\:]+): ", re.MULTILINE),
+                    'scenes': (r"^SCENE \d+:.+?(?=^SCENE)", re.MULTILINE | re.DOTALL),
+                    'optional': r"Camelot(!+)?"}
+        expected = {}
+        for name, pattern in patterns.items():
+            pattern, flags = (pattern, 0) if isinstance(pattern, str) else pattern
+            expected[name] = [(m.start(), m.group())
+                              for m in re.finditer(pattern, self.grail.raw, flags)]
+        pattern_set = PatternSet(patterns)
+        found = pattern_set.search(self.grail.raw)
+        for name in patterns:
+            self.assertEqual([(m.start(), m.group()) for m in found[name]], expected[name])
+        raw = self.grail.raw
+        for size in (7, 500, 5000):
+            chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+            found = {name: [] for name in patterns}
+            for name, offset, match in pattern_set.scan_chunks(chunks):
+                found[name].append((offset, match.group()))
+            self.assertEqual(found, expected)
+        # scenes span many chunks of size 500
+        self.assertTrue(max(len(m) for offset, m in expected['scenes']) > 5000)
+
+    def test_alignment(self):
+        """Regex matches map to tokens and tokens map back to the raw text."""
+        match = next(self.grail.search(r"Sir Robin"))
+        first, last = self.grail.match_tokens(match)
+        self.assertEqual(self.grail[first:last], ['Sir', 'Robin'])
+        self.assertEqual(self.grail.raw_span(first, last), match.span())
+
+    def test_apply_fsa(self):
+        """The FSA finds the longest match and matches do not overlap."""
+        fsa = FSA('sirs', ['S0', 'S1', 'S2'], ['S2'],
+                  [('S0', 'Sir', 'S1'), ('S1', 'Lancelot', 'S2'), ('S2', 'the', 'S2')])
+        matches = self.grail.apply_fsa(fsa)
+        self.assertTrue('Sir Lancelot the' in [str(match) for offset, match in matches])
+        for (offset1, match1), (offset2, match2) in zip(matches, matches[1:]):
+            self.assertTrue(offset1 + len(match1) <= offset2)
+        for offset, match in matches:
+            self.assertEqual(self.grail[offset:offset + len(match)], match.consumed)
+
+    def test_apply_compiled_fsa(self):
+        """A compiled FSA finds the same matches as the FSA itself."""
+        fsa = self.sirs
+        compiled = fsa.compile()
+        self.assertEqual([(offset, str(match)) for offset, match in self.grail.apply_fsa(fsa)],
+                         [(offset, str(match)) for offset, match in self.grail.apply_fsa(compiled)])
+        ids = compiled.intern(['Sir', 'Robin', 'Sir', 'Bors'])
+        self.assertEqual(compiled.match(ids), 2)
+        self.assertEqual(compiled.match(ids, 2), None)
+
+    def test_fsa_from_regex(self):
+        """A token regular expression gives a minimal FSA with the same matches as
+        the hand-written FSA."""
+        fsa = self.sirs
+        compiled = FSA.from_regex('sirs', '(Sir Robin|Sir Lancelot|Sir (Robin|Lancelot))')
+        self.assertEqual(len(compiled.states), 3)
+        self.assertEqual([(offset, str(match)) for offset, match in self.grail.apply_fsa(fsa)],
+                         [(offset, str(match)) for offset, match in self.grail.apply_fsa(compiled)])
+        self.assertTrue(FSA.from_regex('loop', 'a (b|c)* d').accept('abcbd'))
+        self.assertRaises(ValueError, FSA.from_regex, 'error', 'a (b')
+
+    def test_fsa_token_classes(self):
+        """Transitions on token classes, exact transitions are tried first."""
+        fsa = FSA.from_regex('sirs', r"<lower:sir> <re:[A-Z]\w+>")
+        sirs = set(str(match) for offset, match in self.grail.apply_fsa(fsa))
+        self.assertTrue({'Sir Robin', 'Sir Lancelot', 'Sir Galahad'}.issubset(sirs))
+        compiled = [str(match) for offset, match in self.grail.apply_fsa(fsa.compile())]
+        self.assertEqual(set(compiled), sirs)
+        fsa = FSA('titles', ['S0', 'S1', 'S2'], ['S1', 'S2'],
+                  [('S0', 'Sir', 'S2'), ('S0', Predicate(str.istitle), 'S1')])
+        self.assertEqual(fsa.states['S0'].next('Sir').name, 'S2')
+        self.assertEqual(fsa.states['S0'].next('King').name, 'S1')
+        self.assertEqual(fsa.states['S0'].next('king'), None)
+
+    def test_fsa_overlapping_classes(self):
+        """A token in several classes goes to all their targets, without the
+        automaton growing with the number of class combinations."""
+        fsa = FSA.from_regex('sirs', r"<re:S.*> Robin | <re:.*r> Lancelot | Sir Galahad")
+        for sir in ('Sir Robin', 'Sir Lancelot', 'Sir Galahad', 'Ser Robin'):
+            self.assertEqual(fsa.longest_match(sir.split()), 2)
+            compiled = fsa.compile()
+            self.assertEqual(compiled.match(compiled.intern(sir.split())), 2)
+        self.assertEqual(fsa.longest_match('Ser Lancelot'.split()), 2)
+        self.assertEqual(fsa.longest_match('Sam Lancelot'.split()), None)
+        pattern = '(%s) Robin' % ' | '.join('<re:%s.*>' % c for c in 'ABCDEFGHIJKLMNOPQRST')
+        fsa = FSA.from_regex('many', pattern)
+        self.assertEqual(len(fsa.states), 3)
+        self.assertEqual(fsa.longest_match(['ABC', 'Robin']), 2)
+
+    def test_consume_threads(self):
+        """One FSA can be used from several threads at once."""
+        fsa = self.sirs
+        tokens = list(self.grail)
+        with ThreadPoolExecutor(4) as executor:
+            matches = list(executor.map(lambda i: fsa.consume(tokens, start=i), range(len(tokens))))
+        found = [(i, str(m)) for i, m in enumerate(matches) if m]
+        expected = [(offset, str(m)) for offset, m in self.grail.apply_fsa(fsa)]
+        self.assertEqual(found, expected)
+        self.assertEqual(matches[found[0][0]].consumed, found[0][1].split())
+
+    def test_apply_fsas(self):
+        """Several FSAs in one scan give the same matches as one scan for each."""
+        fsas = [self.sirs,
+                FSA('titles', ['S0', 'S1'], ['S1'],
+                    [('S0', 'Sir', 'S1'), ('S0', 'King', 'S1')]),
+                FSA.from_regex('knights', r"<lower:sir> <re:[A-Z]\w+>")]
+        results = self.grail.apply_fsas(fsas)
+        for fsa in fsas:
+            expected = [(offset, str(match)) for offset, match in self.grail.apply_fsa(fsa)]
+            found = [(offset, str(match)) for offset, match in results[fsa.name]]
+            self.assertEqual(found, expected)
+            self.assertTrue(len(found) > 10)
+
 
 if __name__ == '__main__':
 
@@ -5,12 +5,19 @@ Tests for the first two parts of assignment 4.
 """
 
 
+import os
 import sys
 import unittest
 import warnings
+import tempfile
+
+import nltk
 
 from main_a4 import Text
 import brown
+from tagstats import TagStatistics
+from tagging import tag_sentences
+import postag
 
 
 def ignore_warnings(test_func):
@@ -78,6 +85,79 @@ class ExploreTaggedCorpusTests(unittest.TestCase):
         self.assertTrue(0.78 < self.ambiguous_tokens < 0.88)
 
 
+class CompiledBrownTests(unittest.TestCase):
+
+    def test_compiled_round_trip(self):
+        """Compiled tagged sentences are saved and loaded without changes."""
+        sentences = [[('The', 'AT'), ('dog', 'NN'), ('barked', 'VBD')],
+                     [('Dogs', 'NNS'), ('bark', 'VB'), ('.', '.')]]
+        compiled = brown.compile_brown(sentences)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'brown.pickle')
+            brown.save_compiled(compiled, filename)
+            bc = brown.BrownCorpus(filename)
+        self.assertEqual(len(bc), 6)
+        self.assertEqual(list(bc.sentences()), sentences)
+        self.assertEqual(bc.tags[bc.tag_ids[1]], 'NN')
+
+    def test_tag_statistics(self):
+        """All answers come from the same tables and agree with each other."""
+        sentences = [[('The', 'AT'), ('dogs', 'NNS'), ('bark', 'VB')],
+                     [('A', 'AT'), ('dog', 'NN'), ('and', 'CC'), ('dogs', 'NNS')],
+                     [('Dogs', 'NNS'), ('bark', 'NN')]]
+        stats = self.statistics(sentences)
+        self.assertEqual(stats.nouns_more_common_in_plural_form(), ['dog'])
+        self.assertEqual(stats.which_word_has_greatest_number_of_distinct_tags(),
+                         [('bark', ['VB', 'NN'])])
+        self.assertEqual(stats.tags_in_order_of_decreasing_frequency()[0], ('NNS', 3))
+        self.assertEqual(stats.tags_that_nouns_are_most_commonly_found_after()[0], ('AT', 2))
+        self.assertEqual(stats.proportion_ambiguous_word_types(), 1 / 7)
+        self.assertEqual(stats.proportion_ambiguous_word_tokens(), 2 / 9)
+
+    def statistics(self, sentences):
+        compiled = brown.compile_brown(sentences)
+        return TagStatistics(compiled['words'], compiled['tags'],
+                             compiled['word_ids'], compiled['tag_ids'])
+
+
+class TaggerModelTests(unittest.TestCase):
+
+    def test_exported_model(self):
+        """The exported model is loaded from disk and tags like the NLTK taggers."""
+        sentences = [[('The', 'AT'), ('dog', 'NN'), ('can', 'MD'), ('run', 'VB')],
+                     [('A', 'AT'), ('can', 'NN'), ('of', 'IN'), ('beans', 'NNS')],
+                     [('They', 'PPSS'), ('can', 'MD'), ('beans', 'VB'), ('.', '.')]]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'postag.model')
+            postag.train(sentences, filename)
+            model = postag.TaggerModel.load(filename)
+            tagger = nltk.NgramTagger(3, sentences, backoff=nltk.NgramTagger(
+                2, sentences, backoff=nltk.UnigramTagger(
+                    sentences, backoff=nltk.DefaultTagger(postag.DEFAULT_TAG))))
+            for words in (['A', 'can', 'can', 'run', '.'], ['They', 'can', 'dingelhopper']):
+                self.assertEqual(model.tag(words), tagger.tag(words))
+            del model
+
+    def test_parallel_evaluation(self):
+        """Evaluation in shards over worker processes counts the same as in one process."""
+        sentences = [[('The', 'AT'), ('dog', 'NN'), ('can', 'MD'), ('run', 'VB')],
+                     [('A', 'AT'), ('can', 'NN'), ('of', 'IN'), ('beans', 'NNS')]]
+        test = [[('A', 'AT'), ('dog', 'NN'), ('can', 'MD'), ('bark', 'VB')],
+                [('The', 'AT'), ('beans', 'NNS'), ('run', 'VB')]] * 3
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'postag.model')
+            postag.train(sentences, filename)
+            single = postag.evaluate_sentences(test, filename, workers=1)
+            parallel = postag.evaluate_sentences(iter(test), filename, workers=2, shard_size=1)
+        self.assertEqual(single.confusion, parallel.confusion)
+        self.assertEqual(single.tokens, 21)
+        # 'bark' is unknown and gets the default tag NN
+        self.assertEqual(single.confusion[('VB', 'NN')], 3)
+        self.assertAlmostEqual(single.accuracy(), 18 / 21)
+        self.assertAlmostEqual(single.recall('VB'), 3 / 6)
+        self.assertAlmostEqual(single.precision('NN'), 3 / 6)
+
+
 class ExploreTextTests(unittest.TestCase):
 
     @classmethod
@@ -88,6 +168,39 @@ class ExploreTextTests(unittest.TestCase):
         cls.ambiguous_types = cls.grail.proportion_ambiguous_word_types()
         cls.ambiguous_tokens = cls.grail.proportion_ambiguous_word_tokens()
 
+    def test_tagged_once(self):
+        """Tags are added once and there is a tag for each token."""
+        words, tags, word_ids, tag_ids = self.grail.tag_arrays()
+        self.assertIs(self.grail.tag_arrays()[3], tag_ids)
+        self.assertEqual(len(tag_ids), len(self.grail))
+        self.assertIs(self.grail.tag_stats(), self.grail.tag_stats())
+
+    def test_cached_tags(self):
+        """Tagging with and without the cache, and loading cached tags, gives the
+        same sentences, words and tags."""
+        text = ("Mr. Smith went to Washington. He met Dr. Jones there ! Did he "
+                "stay ? No... He left on the 3 p.m. train to N.Y. and was home by 6.")
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'small.txt')
+            with open(filename, 'w') as fh:
+                fh.write(text * 3)
+            uncached = Text(filename, cache=False)
+            self.assertEqual(list(uncached.sentences()), list(Text(filename).sentences()))
+            uncached = uncached.tag_arrays()
+            tagged = Text(filename).tag_arrays()
+            loaded = Text(filename).tag_arrays()
+        for arrays in (tagged, loaded):
+            self.assertEqual(list(arrays[0]), list(uncached[0]))
+            self.assertEqual(list(arrays[1]), list(uncached[1]))
+            self.assertEqual(list(arrays[2]), list(uncached[2]))
+            self.assertEqual(list(arrays[3]), list(uncached[3]))
+
+    def test_parallel_tagging(self):
+        """Tagging batches in worker processes gives the same tags in the same order."""
+        sentences = list(self.grail.sentences())[:200]
+        self.assertEqual(tag_sentences(sentences, workers=2, batch_size=50),
+                         tag_sentences(sentences, workers=1))
+
     def test_noun_tags1(self):
         """Overlap of found set and example set is at least 6."""
         # Here the target was lowered from 8 since potentially there was a
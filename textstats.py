@@ -0,0 +1,68 @@
+"""textstats.py
+
+Separate module to calculate all simple statistics on a sequence of tokens in
+one pass: the number of tokens, types and sentences and the frequency
+distributions of content words and content word bigrams.
+
+"""
+
+from collections import Counter
+from itertools import compress, islice
+from operator import and_
+
+from nltk.probability import FreqDist
+
+
+# Tokens that end a sentence
+SENTENCE_END = ('.', '!', '?')
+
+# Number of tokens taken from the input at a time, counting a list of tokens is
+# much faster than counting them one by one
+BATCH_SIZE = 2 ** 16
+
+
+class TextStatistics(object):
+
+    """Statistics for a sequence of tokens, which can be anything that can be
+    iterated over once (a list, a Text or a TokenStream). All statistics are
+    collected in a single pass, where most of the work is done in batches by
+    Counter.update(). The content_word function is called only once for each
+    distinct token. Content words and bigrams are not normalized."""
+
+    def __init__(self, tokens, content_word, batch_size=BATCH_SIZE):
+        counts = Counter()
+        bigrams = Counter()
+        # maps each distinct token on whether it is a content word
+        content = {}
+        previous = None
+        tokens = iter(tokens)
+        while True:
+            batch = list(islice(tokens, batch_size))
+            if not batch:
+                break
+            counts.update(batch)
+            for token in set(batch).difference(content):
+                content[token] = content_word(token)
+            # include the last token of the previous batch so we do not miss
+            # the bigram that straddles the two batches
+            if previous is not None:
+                batch.insert(0, previous)
+            flags = list(map(content.__getitem__, batch))
+            pairs = zip(batch, islice(batch, 1, None))
+            bigrams.update(compress(pairs, map(and_, flags, islice(flags, 1, None))))
+            previous = batch[-1]
+        self.tokens = sum(counts.values())
+        self.types = len(set(t.lower() for t in counts))
+        self.sentences = sum(counts[t] for t in SENTENCE_END)
+        self.content_words = FreqDist({t: c for t, c in counts.items() if content[t]})
+        self.content_bigrams = FreqDist(bigrams)
+
+    def __str__(self):
+        return "<TextStatistics tokens=%d types=%d sentences=%d>" \
+            % (self.tokens, self.types, self.sentences)
+
+    def most_frequent_content_words(self, n=25):
+        return self.content_words.most_common(n=n)
+
+    def most_frequent_bigrams(self, n=25):
+        return self.content_bigrams.most_common(n=n)